@@ -0,0 +1,466 @@
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+import paho.mqtt.client as mqtt
+from app import socketio
+from app.emitter import BatchEmitter, session_room, topic_rooms
+from app.history import topic_history
+from app.metrics import metrics
+from app.mqtt_client import MQTTClient
+from app.online_inference import online_inference
+from app.outbox import Outbox, expire_outboxes
+
+pool_clients = metrics.gauge('mqtt_pool_clients', '连接池中的客户端数', ['client_type'])
+pool_evictions = metrics.counter('mqtt_pool_evictions_total', '连接池回收的客户端数', ['reason'])
+
+
+def filter_covers(outer, inner):
+    """主题过滤器outer匹配的主题是否包含inner匹配的所有主题"""
+    outer_levels, inner_levels = outer.split('/'), inner.split('/')
+    for i, level in enumerate(outer_levels):
+        if level == '#':
+            return True
+        if i >= len(inner_levels) or inner_levels[i] == '#':
+            return False
+        if level != '+' and level != inner_levels[i]:
+            return False
+    return len(outer_levels) == len(inner_levels)
+
+
+class NetworkLoop:
+    """一个线程用select同时驱动多个paho客户端的网络收发，代替每个客户端一个loop_start线程
+
+    连接意外断开的客户端按退避间隔自动重连；重连（TCP连接和TLS握手会阻塞）在单独的线程中进行，
+    一个不可达的broker不会让其他客户端的收发和心跳停下来。
+    所有写操作都在本线程完成：客户端注册了on_socket_register_write后，paho在其他线程publish时
+    不再直接写套接字，只把数据包放入队列并通过唤醒管道让select立即返回，由本线程写出，
+    避免两个线程同时写同一个套接字导致数据包交错。
+    """
+
+    def __init__(self, select_timeout=0.05, misc_interval=1.0, reconnect_delay=(1, 30)):
+        self.select_timeout = select_timeout
+        self.misc_interval = misc_interval
+        self.min_delay, self.max_delay = reconnect_delay
+        self.clients = set()
+        self.housekeeping = []
+        self.retry = {}  # 客户端 -> (下次重连时间, 当前退避间隔)
+        self.reconnecting = set()  # 正在后台线程中重连的客户端
+        self.lock = threading.Lock()
+        # 一轮收发期间持有，remove返回后本线程不会再操作被移除客户端的套接字
+        self.poll_lock = threading.RLock()
+        self.thread = None
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+
+    def wakeup(self, *args):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # 管道已满说明已经有未处理的唤醒
+            pass
+
+    def add(self, mqtt_client):
+        mqtt_client.client.on_socket_register_write = self.wakeup
+        with self.lock:
+            self.clients.add(mqtt_client)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name='mqtt-network-loop')
+                self.thread.start()
+
+    def remove(self, mqtt_client):
+        """移除客户端，返回后调用方可以在自己的线程中操作它的套接字"""
+        with self.lock:
+            self.clients.discard(mqtt_client)
+            self.retry.pop(mqtt_client, None)
+        self.wakeup()
+        # 等待正在进行的一轮收发结束
+        with self.poll_lock:
+            mqtt_client.client.on_socket_register_write = None
+
+    def _reconnect(self, mqtt_client, now):
+        """到了重连时间时在后台线程中重连，同一客户端同时只有一个重连线程"""
+        with self.lock:
+            next_attempt, delay = self.retry.get(mqtt_client, (now, self.min_delay))
+            if now < next_attempt or mqtt_client in self.reconnecting:
+                return
+            self.reconnecting.add(mqtt_client)
+        threading.Thread(target=self._reconnect_worker, args=(mqtt_client, delay), daemon=True,
+                         name=f'mqtt-reconnect-{mqtt_client.client_id}').start()
+
+    def _reconnect_worker(self, mqtt_client, delay):
+        try:
+            mqtt_client.client.reconnect()
+            failed = False
+        except (OSError, ValueError) as e:
+            print(f"Client {mqtt_client.client_id} reconnect failed: {e}")
+            failed = True
+        with self.lock:
+            self.reconnecting.discard(mqtt_client)
+            removed = mqtt_client not in self.clients
+            if not removed:
+                if failed:
+                    self.retry[mqtt_client] = (time.time() + delay, min(delay * 2, self.max_delay))
+                else:
+                    self.retry.pop(mqtt_client, None)
+        if removed and not failed:
+            # 重连期间客户端已被移除，关闭刚建立的连接
+            mqtt_client.client.disconnect()
+        else:
+            self.wakeup()
+
+    def _service(self, mqtt_client, method, now):
+        """调用客户端的一个网络处理方法，套接字异常时按断线处理并安排重连"""
+        try:
+            getattr(mqtt_client.client, method)()
+        except (OSError, ValueError) as e:
+            print(f"Client {mqtt_client.client_id} network error: {e}")
+            mqtt_client.on_disconnect(mqtt_client.client, None, mqtt.MQTT_ERR_CONN_LOST)
+            if mqtt_client.should_connect:
+                self._reconnect(mqtt_client, now)
+
+    def _run(self):
+        last_misc = 0.0
+        while True:
+            with self.poll_lock:
+                last_misc = self._poll(last_misc)
+
+    def _poll(self, last_misc):
+        """一轮select收发，客户端列表只保存在局部变量中，移除的客户端不会被线程一直引用"""
+        with self.lock:
+            clients = list(self.clients)
+        readers, writers = {}, {}
+        now = time.time()
+        for mqtt_client in clients:
+            sock = mqtt_client.client.socket()
+            if sock is None:
+                if mqtt_client.should_connect:
+                    self._reconnect(mqtt_client, now)
+                continue
+            readers[sock] = mqtt_client
+            if mqtt_client.client.want_write():
+                writers[sock] = mqtt_client
+
+        try:
+            readable, writable, _ = select.select(list(readers) + [self.wakeup_reader], list(writers), [],
+                                                  self.select_timeout)
+        except (OSError, ValueError):
+            # 有套接字在select期间被关闭，下一轮重新收集
+            readable, writable = [], []
+        for sock in readable:
+            if sock is self.wakeup_reader:
+                # 有新的待写数据包，下一轮会把对应套接字加入写集合
+                try:
+                    self.wakeup_reader.recv(4096)
+                except BlockingIOError:
+                    pass
+            else:
+                self._service(readers[sock], 'loop_read', now)
+        for sock in writable:
+            self._service(writers[sock], 'loop_write', now)
+
+        if now - last_misc >= self.misc_interval:
+            last_misc = now
+            # 处理心跳和超时
+            for mqtt_client in clients:
+                if mqtt_client.client.socket() is not None:
+                    self._service(mqtt_client, 'loop_misc', now)
+            for task in self.housekeeping:
+                try:
+                    task()
+                except Exception as e:
+                    print(f"Network loop housekeeping error: {e}")
+        return last_misc
+
+
+class SessionSubscriber:
+    """一个会话在某个broker上的订阅端
+
+    同一broker的所有会话共用一个MQTT订阅客户端，共享的历史记录/流式预测/推送器每条消息只处理一次；
+    这里只记录本会话订阅的主题，共享客户端按引用计数订阅和取消订阅。
+    """
+
+    def __init__(self, pool, session_id, broker, port):
+        self.pool = pool
+        self.session_id = session_id
+        self.broker = broker
+        self.port = port
+        self.subscribed_topics = set()
+        self.shared = None
+
+    @property
+    def client_id(self):
+        return self.shared.client_id if self.shared is not None else None
+
+    @property
+    def connected(self):
+        return self.shared is not None and self.shared.connected
+
+    def connect(self, broker=None, port=None):
+        if self.shared is None:
+            self.shared = self.pool._acquire_shared(self)
+        elif not self.shared.connected:
+            self.shared.connect(self.broker, self.port)
+        return self.shared.connected
+
+    def subscribe(self, topic, qos=1):
+        if self.shared is None or topic in self.subscribed_topics:
+            return self.shared is not None
+        if not self.pool._subscribe_shared(self, topic, qos):
+            return False
+        self.subscribed_topics.add(topic)
+        return True
+
+    def unsubscribe(self, topic):
+        if topic not in self.subscribed_topics:
+            return False
+        self.subscribed_topics.discard(topic)
+        return self.pool._unsubscribe_shared(self, topic)
+
+    def busy(self):
+        """有订阅且会话还有浏览器页面连着Socket.IO（数据只通过Socket.IO推送，不会有HTTP请求）"""
+        if not self.subscribed_topics:
+            return False
+        participants = socketio.server.manager.get_participants('/', session_room(self.session_id))
+        return next(iter(participants), None) is not None
+
+    def disconnect(self):
+        for topic in list(self.subscribed_topics):
+            self.unsubscribe(topic)
+        if self.shared is not None:
+            self.pool._release_shared(self)
+            self.shared = None
+
+
+class MQTTClientPool:
+    """按(会话, 客户端类型, broker)管理的MQTT客户端池
+
+    发布端每个会话一个客户端；订阅端每个broker一个共享客户端，会话通过SessionSubscriber使用。
+    客户端共享一个网络线程和同一个推送器/历史记录/流式预测；
+    池的大小有上限，超过idle_timeout未使用的客户端会被断开回收，满时回收最久未使用的客户端。
+    """
+
+    def __init__(self, max_clients=64, idle_timeout=1800, network_loop=None, emitter=None, history=topic_history,
+                 inference=online_inference, outbox_max_age=7 * 24 * 3600, outbox_cleanup_interval=3600):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.outbox_max_age = outbox_max_age
+        self.outbox_cleanup_interval = outbox_cleanup_interval
+        self.last_outbox_cleanup = 0.0
+        self.network_loop = network_loop or NetworkLoop()
+        self.network_loop.housekeeping.append(self.evict_idle)
+        self.network_loop.housekeeping.append(self.cleanup_outboxes)
+        self.emitter = emitter or BatchEmitter(flush_interval=0.1, max_batch_size=200, rooms=topic_rooms)
+        self.history = history
+        self.inference = inference
+        self.entries = OrderedDict()
+        # (broker, port) -> {'client', 'sessions', 'topics': {过滤器: {'refs', 'qos'}}, 'broker_topics': {过滤器: qos}}
+        self.shared = {}
+        self.lock = threading.Lock()
+
+    def _client_id(self, session_id, client_type):
+        # 同一会话使用固定的client_id，持久会话在重新连接后仍然有效
+        return f'{client_type}-{session_id[:16]}'
+
+    def get(self, session_id, client_type, broker, port):
+        """取已有的客户端并更新使用时间，不存在时返回None"""
+        key = (session_id, client_type, broker, port)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            self.entries.move_to_end(key)
+            return entry['client']
+
+    def find(self, session_id, client_type):
+        """会话的该类型客户端（每个会话每种类型只保留一个），不更新使用时间"""
+        with self.lock:
+            for key, entry in self.entries.items():
+                if key[:2] == (session_id, client_type):
+                    return entry['client']
+        return None
+
+    def connect(self, session_id, client_type, broker, port):
+        """取得会话连接到指定broker的客户端，没有时创建并连接"""
+        mqtt_client = self.get(session_id, client_type, broker, port)
+        if mqtt_client is not None:
+            if not mqtt_client.connected:
+                mqtt_client.connect(broker, port)
+            return mqtt_client
+
+        key = (session_id, client_type, broker, port)
+        if client_type == 'subscriber':
+            mqtt_client = SessionSubscriber(self, session_id, broker, port)
+        else:
+            client_id = self._client_id(session_id, client_type)
+            # 发布端断线期间的消息写入按client_id和broker命名的发件箱，
+            # 同一会话重新连接同一broker后继续补发，不会发到别的broker
+            mqtt_client = MQTTClient(client_id, emitter=self.emitter, network_loop=self.network_loop,
+                                     outbox=Outbox(f'{client_id}@{broker}:{port}'), client_type=client_type,
+                                     room=session_room(session_id))
+        evicted = []
+        with self.lock:
+            # 同一会话同类型只保留一个broker的连接
+            for other_key in [k for k in self.entries if k[:2] == key[:2]]:
+                evicted.append((self.entries.pop(other_key)['client'], 'replaced'))
+            while len(self.entries) >= self.max_clients:
+                _, oldest = self.entries.popitem(last=False)
+                evicted.append((oldest['client'], 'full'))
+            self.entries[key] = {'client': mqtt_client, 'last_used': time.time()}
+        for old_client, reason in evicted:
+            self._close(old_client, reason)
+        self._update_gauge()
+        mqtt_client.connect(broker, port)
+        return mqtt_client
+
+    def _acquire_shared(self, subscriber):
+        """取得broker的共享订阅客户端，没有时创建并连接"""
+        key = (subscriber.broker, subscriber.port)
+        with self.lock:
+            shared = self.shared.get(key)
+            if shared is None:
+                mqtt_client = MQTTClient(f'subscriber-shared-{subscriber.broker}-{subscriber.port}',
+                                         emitter=self.emitter, history=self.history, inference=self.inference,
+                                         network_loop=self.network_loop, client_type='subscriber', room=[])
+                shared = self.shared[key] = {'client': mqtt_client, 'sessions': set(), 'topics': {},
+                                             'broker_topics': {}}
+            shared['sessions'].add(subscriber.session_id)
+            mqtt_client = shared['client']
+            # 连接状态只推送给使用该客户端的会话
+            mqtt_client.room = [session_room(session_id) for session_id in shared['sessions']]
+        if not mqtt_client.connected:
+            mqtt_client.connect(*key)
+        return mqtt_client
+
+    def _release_shared(self, subscriber):
+        key = (subscriber.broker, subscriber.port)
+        with self.lock:
+            shared = self.shared.get(key)
+            if shared is None:
+                return
+            shared['sessions'].discard(subscriber.session_id)
+            shared['client'].room = [session_room(session_id) for session_id in shared['sessions']]
+            if shared['sessions']:
+                return
+            del self.shared[key]
+        shared['client'].disconnect()
+
+    def _subscribe_shared(self, subscriber, topic, qos):
+        with self.lock:
+            shared = self.shared.get((subscriber.broker, subscriber.port))
+            if shared is None or not shared['client'].connected:
+                return False
+            entry = shared['topics'].setdefault(topic, {'refs': 0, 'qos': qos})
+            entry['refs'] += 1
+            entry['qos'] = max(entry['qos'], qos)
+            if self._sync_shared(shared):
+                return True
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del shared['topics'][topic]
+            return False
+
+    def _unsubscribe_shared(self, subscriber, topic):
+        with self.lock:
+            shared = self.shared.get((subscriber.broker, subscriber.port))
+            if shared is None or topic not in shared['topics']:
+                return False
+            entry = shared['topics'][topic]
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del shared['topics'][topic]
+            self._sync_shared(shared)
+            return True
+
+    def _sync_shared(self, shared):
+        """让共享客户端在broker上只订阅不被其他过滤器覆盖的过滤器
+
+        重叠的订阅（如a/#和a/b）会让broker把同一条消息投递多次，共享的数据处理也会重复
+        """
+        topics = shared['topics']
+        wanted = {topic: entry['qos'] for topic, entry in topics.items()
+                  if not any(other != topic and topics[other]['qos'] >= entry['qos'] and filter_covers(other, topic)
+                             for other in topics)}
+        mqtt_client = shared['client']
+        success = True
+        for topic, qos in wanted.items():
+            if shared['broker_topics'].get(topic) != qos:
+                if mqtt_client.subscribe(topic, qos=qos):
+                    shared['broker_topics'][topic] = qos
+                else:
+                    success = False
+        # 先订阅新的过滤器再取消被覆盖的，避免中间漏掉消息
+        for topic in [t for t in shared['broker_topics'] if t not in wanted]:
+            del shared['broker_topics'][topic]
+            # 断线时取消订阅会失败，也不能在重连后重新订阅
+            mqtt_client.subscribed_topics.discard(topic)
+            mqtt_client.unsubscribe(topic)
+        return success
+
+    def release(self, session_id, client_type):
+        """断开并移除会话的客户端"""
+        with self.lock:
+            keys = [k for k in self.entries if k[:2] == (session_id, client_type)]
+            clients = [self.entries.pop(k)['client'] for k in keys]
+        for mqtt_client in clients:
+            self._close(mqtt_client, 'released')
+        self._update_gauge()
+
+    def evict_idle(self):
+        """回收超过idle_timeout未使用的客户端，正在回放、补发或推送订阅数据的客户端视为仍在使用"""
+        now = time.time()
+        deadline = now - self.idle_timeout
+        with self.lock:
+            candidates = [(k, entry['client']) for k, entry in self.entries.items() if entry['last_used'] < deadline]
+        busy = {k for k, mqtt_client in candidates if mqtt_client.busy()}
+        with self.lock:
+            clients = []
+            for key, mqtt_client in candidates:
+                entry = self.entries.get(key)
+                if entry is None or entry['client'] is not mqtt_client:
+                    continue
+                if key in busy:
+                    entry['last_used'] = now
+                else:
+                    clients.append(self.entries.pop(key)['client'])
+        for mqtt_client in clients:
+            self._close(mqtt_client, 'idle')
+        if clients:
+            self._update_gauge()
+
+    def cleanup_outboxes(self):
+        """定期删除长时间没有写入、也不属于池中任何客户端的发件箱文件"""
+        now = time.time()
+        if now - self.last_outbox_cleanup < self.outbox_cleanup_interval:
+            return
+        self.last_outbox_cleanup = now
+        with self.lock:
+            keep = {entry['client'].outbox.path for entry in self.entries.values()
+                    if getattr(entry['client'], 'outbox', None) is not None}
+        removed = expire_outboxes(max_age=self.outbox_max_age, keep=keep)
+        if removed:
+            print(f"Removed {removed} expired outbox file(s)")
+
+    def _close(self, mqtt_client, reason):
+        pool_evictions.inc(reason=reason)
+        replay_engine = getattr(mqtt_client, 'replay_engine', None)
+        if replay_engine is not None:
+            replay_engine.stop()
+        try:
+            mqtt_client.disconnect()
+        except Exception as e:
+            print(f"Client {mqtt_client.client_id} disconnect error: {e}")
+
+    def _update_gauge(self):
+        with self.lock:
+            counts = {'publisher': 0, 'subscriber': 0}
+            for session_id, client_type, broker, port in self.entries:
+                counts[client_type] = counts.get(client_type, 0) + 1
+        for client_type, count in counts.items():
+            pool_clients.set(count, client_type=client_type)
+
+
+client_pool = MQTTClientPool()
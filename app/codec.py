@@ -0,0 +1,158 @@
+import json
+import struct
+import threading
+import numpy as np
+from paho.mqtt.client import topic_matches_sub
+from src.data_processor import to_datetime64
+
+
+class JSONCodec:
+    """默认编码：每条读数一个JSON对象，多条时为JSON数组"""
+
+    name = 'json'
+
+    def encode(self, readings):
+        return json.dumps(readings[0] if len(readings) == 1 else readings).encode('utf-8')
+
+    def decode(self, payload):
+        data = json.loads(payload)
+        return data if isinstance(data, list) else [data]
+
+
+class PackedCodec:
+    """紧凑的二进制批量编码，一条MQTT消息携带多条读数
+
+    格式（小端）：
+        头部   magic(4s) flags(B) 字段数(B) 条数(I) 首条时间戳(q，秒)
+        字段名 每个字段 长度(B) + UTF-8名称
+        时间戳 条数-1个相邻差值，flags第0位为1时为int32，否则为int16
+        数值   每个字段一列float32，缺失值为NaN
+
+    只有能无损表示的读数才会打包，否则抛出ValueError（PayloadCodecs会回退到JSON）：
+    time必须是精确到秒的时间字符串，其余字段必须是数值或None，
+    数值按float32保存，解码时取float32的最短十进制表示（21.6仍解码为21.6），
+    float32无法精确表示的数值（如21.123456789）不能打包。
+    """
+
+    name = 'packed'
+    MAGIC = b'WPK1'
+    HEADER = struct.Struct('<4sBBIq')
+    WIDE_DELTAS = 0x01
+
+    def encode(self, readings):
+        seconds = self._seconds([reading.get('time') for reading in readings])
+        fields = sorted({key for reading in readings for key in reading if key != 'time'})
+        if len(fields) > 255:
+            raise ValueError('字段过多')
+        encoded_fields = [field.encode('utf-8') for field in fields]
+        if any(len(encoded) > 255 for encoded in encoded_fields):
+            raise ValueError('字段名过长')
+        columns = [self._column([reading.get(field) for reading in readings]) for field in fields]
+
+        deltas = np.diff(seconds)
+        wide = len(deltas) and (deltas.min() < -32768 or deltas.max() > 32767)
+        if wide and (deltas.min() < -2 ** 31 or deltas.max() >= 2 ** 31):
+            raise ValueError('相邻时间戳间隔过大')
+        parts = [self.HEADER.pack(self.MAGIC, self.WIDE_DELTAS if wide else 0, len(fields), len(readings),
+                                  int(seconds[0]))]
+        for encoded in encoded_fields:
+            parts.append(struct.pack('<B', len(encoded)) + encoded)
+        parts.append(deltas.astype('<i4' if wide else '<i2').tobytes())
+        parts.extend(column.tobytes() for column in columns)
+        return b''.join(parts)
+
+    @staticmethod
+    def _seconds(times):
+        """时间字符串转为Unix秒，无效或带有小数秒时抛出ValueError"""
+        if not all(isinstance(t, str) for t in times):
+            raise ValueError('packed编码要求每条读数都有time字符串')
+        timestamps = to_datetime64(times, unit='us')
+        if np.isnat(timestamps).any():
+            raise ValueError('packed编码要求每条读数都有有效的time')
+        micros = timestamps.astype(np.int64)
+        if (micros % 1000000).any():
+            raise ValueError('packed编码只支持精确到秒的时间')
+        return micros // 1000000
+
+    @staticmethod
+    def _column(values):
+        """一个字段的float32列，None保存为NaN；非数值或float32无法精确表示的值抛出ValueError"""
+        column = np.empty(len(values), dtype='<f4')
+        for i, value in enumerate(values):
+            if value is None:
+                column[i] = np.nan
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'packed编码不支持非数值字段: {value!r}')
+            packed = np.float32(value)
+            # NaN会被解码为None，也算不能无损表示
+            if value != value or float(str(packed)) != value:
+                raise ValueError(f'float32无法精确表示: {value!r}')
+            column[i] = packed
+        return column
+
+    def decode(self, payload):
+        magic, flags, field_count, count, base = self.HEADER.unpack_from(payload, 0)
+        offset = self.HEADER.size
+        fields = []
+        for _ in range(field_count):
+            length = payload[offset]
+            fields.append(bytes(payload[offset + 1:offset + 1 + length]).decode('utf-8'))
+            offset += 1 + length
+
+        delta_type = np.dtype('<i4' if flags & self.WIDE_DELTAS else '<i2')
+        deltas = np.frombuffer(payload, dtype=delta_type, count=max(count - 1, 0), offset=offset)
+        offset += deltas.nbytes
+        seconds = base + np.concatenate([[0], np.cumsum(deltas, dtype=np.int64)])
+        times = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s').tolist()
+
+        columns = {}
+        for field in fields:
+            column = np.frombuffer(payload, dtype='<f4', count=count, offset=offset)
+            offset += column.nbytes
+            # 取float32的最短十进制表示，避免21.6变成21.600000381469727；NaN在JSON中无效，转为None
+            columns[field] = [None if value != value else float(str(value)) for value in column]
+
+        return [dict({field: columns[field][i] for field in fields}, time=times[i]) for i in range(count)]
+
+
+class PayloadCodecs:
+    """按主题选择编码，解码时根据载荷头部自动识别"""
+
+    def __init__(self, default='json'):
+        self.codecs = {codec.name: codec for codec in (JSONCodec(), PackedCodec())}
+        self.default = default
+        self.rules = []  # [(主题过滤器, 编码名)]，后设置的优先（单个主题的编码可以覆盖之前的通配符规则）
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def set_codec(self, topic_filter, name):
+        if name not in self.codecs:
+            raise ValueError(f'未知的编码: {name}')
+        with self.lock:
+            self.rules = [(topic_filter, name)] + [(f, n) for f, n in self.rules if f != topic_filter]
+            self.cache.clear()
+
+    def codec_for(self, topic):
+        with self.lock:
+            name = self.cache.get(topic)
+            if name is None:
+                name = next((n for f, n in self.rules if topic_matches_sub(f, topic)), self.default)
+                self.cache[topic] = name
+        return self.codecs[name]
+
+    def encode(self, topic, readings):
+        """编码一组读数，返回(载荷, 使用的编码名)；packed无法编码时回退到JSON"""
+        codec = self.codec_for(topic)
+        if codec.name != 'json':
+            try:
+                return codec.encode(readings), codec.name
+            except ValueError:
+                pass
+        return self.codecs['json'].encode(readings), 'json'
+
+    def decode(self, payload):
+        """解码为读数列表"""
+        if payload[:4] == PackedCodec.MAGIC:
+            return self.codecs['packed'].decode(payload)
+        return self.codecs['json'].decode(payload)
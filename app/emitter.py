@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import deque
+from paho.mqtt.client import topic_matches_sub
+from app import socketio
+from app.metrics import metrics
+
+emit_delay_seconds = metrics.histogram('socketio_emit_delay_seconds', '批次中最早的消息从收到到推送的等待时间', ['event'])
+emit_seconds = metrics.histogram('socketio_emit_seconds', 'socketio.emit调用耗时', ['event'])
+dropped_total = metrics.counter('socketio_dropped_total', '推送队列满时丢弃的消息数', ['event', 'topic'])
+unrouted_total = metrics.counter('socketio_unrouted_total', '没有浏览器订阅而未推送的批次数', ['event'])
+
+
+def session_room(session_id):
+    """浏览器会话的Socket.IO房间，同一会话的所有页面连接都会加入"""
+    return f'session:{session_id}'
+
+
+class TopicRooms:
+    """按MQTT主题过滤器划分的Socket.IO房间
+
+    浏览器订阅主题时加入对应过滤器的房间，推送时只发给过滤器与消息主题匹配（支持+和#通配符）的房间，
+    没有任何匹配房间时不推送。主题到房间的匹配结果会缓存，房间变化时清空。
+    """
+
+    def __init__(self, namespace='/'):
+        self.namespace = namespace
+        self.members = {}  # 过滤器 -> sid集合
+        self.sid_filters = {}  # sid -> 过滤器集合
+        self.match_cache = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def room(topic_filter):
+        return f'topic:{topic_filter}'
+
+    def join(self, sid, topic_filter):
+        socketio.server.enter_room(sid, self.room(topic_filter), namespace=self.namespace)
+        with self.lock:
+            self.members.setdefault(topic_filter, set()).add(sid)
+            self.sid_filters.setdefault(sid, set()).add(topic_filter)
+            self.match_cache.clear()
+
+    def leave(self, sid, topic_filter):
+        socketio.server.leave_room(sid, self.room(topic_filter), namespace=self.namespace)
+        with self.lock:
+            self._discard(sid, topic_filter)
+            self.sid_filters.get(sid, set()).discard(topic_filter)
+            self.match_cache.clear()
+
+    def remove_sid(self, sid):
+        """浏览器断开时清理（Socket.IO会自动把它移出所有房间）"""
+        with self.lock:
+            for topic_filter in self.sid_filters.pop(sid, set()):
+                self._discard(sid, topic_filter)
+            self.match_cache.clear()
+
+    def _discard(self, sid, topic_filter):
+        members = self.members.get(topic_filter)
+        if members is not None:
+            members.discard(sid)
+            if not members:
+                del self.members[topic_filter]
+
+    def rooms_for(self, topic):
+        with self.lock:
+            rooms = self.match_cache.get(topic)
+            if rooms is None:
+                rooms = self.match_cache[topic] = [self.room(topic_filter) for topic_filter in self.members
+                                                   if topic_matches_sub(topic_filter, topic)]
+            return rooms
+
+    def emit(self, event, data, topic):
+        """推送给订阅了匹配主题的浏览器，返回是否有接收方"""
+        rooms = self.rooms_for(topic)
+        if not rooms:
+            return False
+        # 同一浏览器在多个匹配房间中也只会收到一次
+        socketio.emit(event, data, to=rooms, namespace=self.namespace)
+        return True
+
+
+class BatchEmitter:
+    """按主题合并消息，定时批量推送到Socket.IO
+
+    每个主题的待发送队列有上限，过载时丢弃最旧的数据并计数，
+    避免在浏览器或网络跟不上时无限制地积压。指定rooms时只推送给订阅了该主题的浏览器。
+    """
+
+    def __init__(self, event='new_data_batch', flush_interval=0.1, max_batch_size=200, max_pending=2000,
+                 rooms=None):
+        self.event = event
+        self.rooms = rooms
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.pending = {}
+        self.first_added = {}  # 每个主题队列中最早消息的加入时间
+        self.dropped = {}
+        self.lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.thread = None
+
+    def add(self, topic, data):
+        """加入一条消息，不阻塞调用线程"""
+        with self.lock:
+            queue = self.pending.get(topic)
+            if queue is None:
+                queue = self.pending[topic] = deque(maxlen=self.max_pending)
+                self.first_added[topic] = time.perf_counter()
+            if len(queue) == self.max_pending:
+                self.dropped[topic] = self.dropped.get(topic, 0) + 1
+            queue.append(data)
+            if len(queue) >= self.max_batch_size:
+                self.flush_event.set()
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def flush(self):
+        """把所有主题的待发送数据按批推送出去"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            first_added, self.first_added = self.first_added, {}
+            dropped, self.dropped = self.dropped, {}
+        for topic, count in dropped.items():
+            dropped_total.inc(count, event=self.event, topic=topic)
+        for topic, queue in pending.items():
+            items = list(queue)
+            emit_delay_seconds.observe(time.perf_counter() - first_added[topic], event=self.event)
+            if self.rooms is not None and not self.rooms.rooms_for(topic):
+                unrouted_total.inc(event=self.event)
+                continue
+            for i in range(0, len(items), self.max_batch_size):
+                batch = {
+                    'topic': topic,
+                    'items': items[i:i + self.max_batch_size],
+                    'dropped': dropped.get(topic, 0) if i == 0 else 0
+                }
+                with emit_seconds.time(event=self.event):
+                    if self.rooms is not None:
+                        self.rooms.emit(self.event, batch, topic)
+                    else:
+                        socketio.emit(self.event, batch)
+
+    def _run(self):
+        while True:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Emit error: {e}")
+
+
+topic_rooms = TopicRooms()
@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from paho.mqtt.client import topic_matches_sub
+from src.data_processor import to_datetime64
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'instance', 'history.sqlite3'))
+
+
+def broker_key(broker, port):
+    """历史记录中区分broker的键"""
+    return f'{broker}:{port}'
+
+
+def reading_value(data):
+    """消息中的数值字段（发布端把数值放在temperature字段中）"""
+    value = data.get('value', data.get('temperature'))
+    return np.nan if value is None else value
+
+
+class RingBuffer:
+    """定长的数组环形缓冲区，保存一个主题最近的读数"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype='datetime64[s]')
+        self.values = np.full(capacity, np.nan)
+        self.end = 0
+        self.size = 0
+
+    def extend(self, timestamps, values):
+        timestamps, values = timestamps[-self.capacity:], values[-self.capacity:]
+        positions = (self.end + np.arange(len(values))) % self.capacity
+        self.timestamps[positions] = timestamps
+        self.values[positions] = values
+        self.end = (self.end + len(values)) % self.capacity
+        self.size = min(self.size + len(values), self.capacity)
+
+    def latest(self, limit=None):
+        """按时间排序返回时间最新的limit条读数（读数可能乱序到达，不能按到达顺序取最后几条）"""
+        positions = (self.end - self.size + np.arange(self.size)) % self.capacity
+        timestamps, values = self.timestamps[positions], self.values[positions]
+        order = np.argsort(timestamps, kind='stable')
+        if limit is not None:
+            order = order[len(order) - min(limit, self.size):]
+        return timestamps[order], values[order]
+
+
+class TopicHistory:
+    """服务器端按broker和主题保存的时间序列
+
+    不同broker上的同名主题是不同的数据，按(broker, 主题)分开保存，broker为"地址:端口"。
+    收到的读数先进入待写列表（不阻塞MQTT网络线程），后台线程批量解析后
+    写入每个(broker, 主题)的环形缓冲区，并追加到WAL模式的SQLite中，
+    (broker, topic, ts)上建索引用于时间范围查询。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, capacity=10000, flush_interval=0.5, flush_size=1000):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.buffers = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.thread = None
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute("CREATE TABLE IF NOT EXISTS readings "
+                       "(topic TEXT NOT NULL, ts INTEGER NOT NULL, value REAL, broker TEXT NOT NULL DEFAULT '')")
+            # 旧版本的库没有broker列，之前的读数归到空broker下
+            columns = [row[1] for row in db.execute('PRAGMA table_info(readings)')]
+            if 'broker' not in columns:
+                db.execute("ALTER TABLE readings ADD COLUMN broker TEXT NOT NULL DEFAULT ''")
+            db.execute('DROP INDEX IF EXISTS idx_readings_topic_ts')
+            db.execute('CREATE INDEX IF NOT EXISTS idx_readings_broker_topic_ts ON readings (broker, topic, ts)')
+            db.commit()
+            self.db = db
+        return self.db
+
+    def append(self, broker, topic, data):
+        """记录broker上一个主题的一条读数，只做列表追加"""
+        with self.lock:
+            self.pending.append((broker, topic, data.get('time'), reading_value(data)))
+            if len(self.pending) >= self.flush_size:
+                self.flush_event.set()
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def flush(self):
+        """把待写读数批量写入环形缓冲区和SQLite"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        brokers, topics, times, values = zip(*pending)
+        try:
+            timestamps = to_datetime64(list(times))
+        except (ValueError, TypeError):
+            # 逐条解析，丢弃无效时间
+            timestamps = np.array([self._parse_time(t) for t in times], dtype='datetime64[s]')
+        values = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        brokers, topics = np.asarray(brokers), np.asarray(topics)
+        valid = ~np.isnat(timestamps) & ~np.isnan(values)
+        brokers, topics, timestamps, values = brokers[valid], topics[valid], timestamps[valid], values[valid]
+
+        with self.db_lock:
+            for key in set(zip(brokers.tolist(), topics.tolist())):
+                mask = (brokers == key[0]) & (topics == key[1])
+                buffer = self.buffers.get(key)
+                if buffer is None:
+                    buffer = self.buffers[key] = RingBuffer(self.capacity)
+                buffer.extend(timestamps[mask], values[mask])
+            db = self._connect()
+            db.executemany('INSERT INTO readings (broker, topic, ts, value) VALUES (?, ?, ?, ?)',
+                           zip(brokers.tolist(), topics.tolist(), timestamps.astype(np.int64).tolist(),
+                               values.tolist()))
+            db.commit()
+
+    @staticmethod
+    def _parse_time(value):
+        try:
+            return np.datetime64(value, 's')
+        except (ValueError, TypeError):
+            return np.datetime64('NaT')
+
+    def topics(self, broker):
+        """broker上所有有记录的主题及读数数量"""
+        self.flush()
+        with self.db_lock:
+            rows = self._connect().execute('SELECT topic, COUNT(*) FROM readings WHERE broker = ? GROUP BY topic',
+                                           (broker,)).fetchall()
+        return dict(rows)
+
+    def query(self, broker, topic, start=None, end=None, limit=None):
+        """查询broker上一个主题的读数，返回按时间排序的(timestamps, values)
+
+        只取最近limit条且环形缓冲区中足够时直接从内存返回，否则走SQLite索引。
+        """
+        self.flush()
+        if start is None and end is None and limit is not None:
+            with self.db_lock:
+                buffer = self.buffers.get((broker, topic))
+                if buffer is not None and limit <= buffer.size:
+                    return buffer.latest(limit)
+
+        sql = 'SELECT ts, value FROM readings WHERE broker = ? AND topic = ?'
+        params = [broker, topic]
+        if start is not None:
+            sql += ' AND ts >= ?'
+            params.append(int(np.datetime64(start, 's').astype(np.int64)))
+        if end is not None:
+            sql += ' AND ts <= ?'
+            params.append(int(np.datetime64(end, 's').astype(np.int64)))
+        if limit is not None:
+            # 取最近的limit条
+            sql = f'SELECT ts, value FROM ({sql} ORDER BY ts DESC LIMIT ?)'
+            params.append(int(limit))
+        sql += ' ORDER BY ts'
+        with self.db_lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        if not rows:
+            return np.array([], dtype='datetime64[s]'), np.array([], dtype=np.float64)
+        timestamps, values = zip(*rows)
+        return np.array(timestamps, dtype=np.int64).astype('datetime64[s]'), np.array(values, dtype=np.float64)
+
+    def match_topics(self, broker, topic_filter):
+        """按MQTT通配符匹配broker上已有记录的主题"""
+        if '+' not in topic_filter and '#' not in topic_filter:
+            return [topic_filter]
+        return [topic for topic in self.topics(broker) if topic_matches_sub(topic_filter, topic)]
+
+    def _run(self):
+        while True:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"History write error: {e}")
+
+
+topic_history = TopicHistory()
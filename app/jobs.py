@@ -0,0 +1,151 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tensorflow.keras.callbacks import Callback
+from app import socketio
+from app.emitter import session_room
+from app.metrics import metrics
+from app.prediction import WeatherPredictor
+
+job_duration_seconds = metrics.histogram('training_job_duration_seconds', '训练任务运行时长', ['mode', 'status'])
+job_wait_seconds = metrics.histogram('training_job_wait_seconds', '训练任务排队等待时长')
+jobs_total = metrics.counter('training_jobs_total', '结束的训练任务数', ['status'])
+
+
+def emit_to_job_session(job, event, data):
+    """推送给提交任务的浏览器会话，没有会话（非网页提交）时广播"""
+    socketio.emit(event, data, to=session_room(job['session']) if job['session'] else None)
+
+
+class ProgressCallback(Callback):
+    """每个epoch结束时通过Socket.IO推送训练进度"""
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        self.job['progress'] = {
+            'epoch': epoch + 1,
+            'epochs': self.params.get('epochs'),
+            'loss': float(logs.get('loss', 0.0)),
+            'val_loss': float(logs['val_loss']) if 'val_loss' in logs else None
+        }
+        emit_to_job_session(self.job, 'job_progress', dict(self.job['progress'], job_id=self.job['id']))
+
+
+class TrainingJobManager:
+    """训练任务管理：提交后立即返回任务ID，在有界线程池中训练，结果按任务ID保存"""
+
+    def __init__(self, max_workers=2, max_jobs=50):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='training')
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        metrics.gauge('training_queue_depth', '排队中的训练任务数', function=self.queue_depth)
+        metrics.gauge('training_jobs_running', '运行中的训练任务数',
+                      function=lambda: sum(1 for job in list(self.jobs.values()) if job['status'] == 'running'))
+
+    def submit(self, series, topic, mode='train', session_id=None, **train_kwargs):
+        """提交任务，mode为'train'时完整训练，为'update'时在主题最新模型上增量微调
+
+        session_id为提交任务的浏览器会话，进度只推送给该会话，结果也只对该会话可见
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'session': session_id,
+            'topic': topic,
+            'mode': mode,
+            'version': None,
+            'status': 'queued',
+            'progress': None,
+            'result': None,
+            'metrics': None,
+            'error': None,
+            'from_registry': False,
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            # 只保留最近的任务，从最早的开始清理已结束的任务，排队和运行中的任务跳过
+            excess = len(self.jobs) - self.max_jobs
+            if excess > 0:
+                finished_ids = [old_id for old_id, old in self.jobs.items() if old['status'] in ('finished', 'failed')]
+                for old_id in finished_ids[:excess]:
+                    del self.jobs[old_id]
+        self.executor.submit(self._run, job, series, train_kwargs)
+        return job_id
+
+    def get(self, job_id, session_id=None):
+        """按ID取任务，指定session_id时只返回该会话提交的任务"""
+        job = self.jobs.get(job_id)
+        if job is None or (session_id is not None and job['session'] != session_id):
+            return None
+        return job
+
+    def latest_finished(self, session_id=None):
+        with self.lock:
+            finished = [job for job in self.jobs.values()
+                        if job['status'] == 'finished' and (session_id is None or job['session'] == session_id)]
+        return finished[-1] if finished else None
+
+    def queue_depth(self):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job['status'] == 'queued')
+
+    def summary(self, job):
+        """任务状态（不含预测结果数据）"""
+        return {key: value for key, value in job.items() if key not in ('result', 'session')}
+
+    def _run(self, job, series, train_kwargs):
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        job_wait_seconds.observe(job['started_at'] - job['submitted_at'])
+        emit_to_job_session(job, 'job_status', self.summary(job))
+        try:
+            predictor = WeatherPredictor()
+            if job['mode'] == 'update':
+                results = predictor.update_lstm(series, job['topic'], callbacks=[ProgressCallback(job)], verbose=0,
+                                                **train_kwargs)
+                # 实际执行的方式：增量微调、完整重训或未变化
+                job['mode'] = results['mode']
+            else:
+                results = predictor.train_lstm(series, callbacks=[ProgressCallback(job)], verbose=0,
+                                               topic=job['topic'], **train_kwargs)
+            # 模型仓库中的版本号（完整训练同样会登记新版本）
+            job['version'] = results.get('version')
+            job['from_registry'] = results['from_registry']
+            job['metrics'] = predictor.evaluate_model(results['y_test'], results['test_pred'])
+            job['result'] = self._format_results(results, job['topic'])
+            job['status'] = 'finished'
+        except Exception as e:
+            print(f"Training job {job['id']} failed: {e}")
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = time.time()
+            job_duration_seconds.observe(job['finished_at'] - job['started_at'], mode=job['mode'], status=job['status'])
+            jobs_total.inc(status=job['status'])
+            emit_to_job_session(job, 'job_status', self.summary(job))
+
+    def _format_results(self, results, topic):
+        # 按时间排序（确保时间戳和数据对应）
+        timestamps = results['test_timestamps'].astype('datetime64[s]')
+        order = np.argsort(timestamps)
+        return {
+            'timestamps': timestamps[order].tolist(),
+            'actual_values': results['y_test'].flatten()[order].tolist(),
+            'predicted_values': results['test_pred'].flatten()[order].tolist(),
+            # 结果页面按数据类型（主题最后一段）显示单位
+            'topic': topic.split('/')[-1]
+        }
+
+
+training_jobs = TrainingJobManager()
@@ -0,0 +1,199 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 300.0, 1800.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def samples(self):
+        """返回(名称后缀, 标签值, 额外标签, 数值)列表"""
+        with self.lock:
+            return [('', key, None, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # 抓取时调用，返回数值或{标签值元组: 数值}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        value = self.function()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [('', key, None, item) for key, item in items]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, [('le', _format_value(bound))], cumulative))
+            samples.append(('_sum', key, None, total))
+            samples.append(('_count', key, None, count))
+        return samples
+
+
+class MetricsRegistry:
+    """进程内的指标集合，按Prometheus文本格式输出"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge, name, documentation, labelnames, function=function)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class SampledLogger:
+    """热点路径上的日志：按级别过滤，同一类日志每interval秒最多输出一条并注明省略的条数
+
+    级别由环境变量MQTT_LOG_LEVEL控制（默认WARNING）。
+    """
+
+    def __init__(self, name, interval=5.0, level=None):
+        self.logger = logging.getLogger(name)
+        if not self.logger.handlers and not logging.getLogger().handlers:
+            logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        self.logger.setLevel(level or os.environ.get('MQTT_LOG_LEVEL', 'WARNING').upper())
+        self.interval = interval
+        self.last_logged = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def log(self, level, key, message, *args):
+        """message和args在确定输出时才格式化"""
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_logged.get(key, float('-inf')) < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return
+            self.last_logged[key] = now
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            message += f'（之前{suppressed}条同类日志已省略）'
+        self.logger.log(level, message, *args)
+
+    def debug(self, key, message, *args):
+        self.log(logging.DEBUG, key, message, *args)
+
+    def warning(self, key, message, *args):
+        self.log(logging.WARNING, key, message, *args)
+
+    def error(self, key, message, *args):
+        self.log(logging.ERROR, key, message, *args)
+
+
+metrics = MetricsRegistry()
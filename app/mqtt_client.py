@@ -1,54 +1,176 @@
 import paho.mqtt.client as mqtt
 import json
 from app import socketio
+from app.codec import PayloadCodecs
+from app.emitter import BatchEmitter
+from app.history import broker_key
+from app.metrics import metrics, SampledLogger
+from app.profiles import PublishProfiles, parse_count
+import threading
 import time
 
+messages_received = metrics.counter('mqtt_messages_received_total', '收到的MQTT消息数', ['client', 'topic'])
+messages_published = metrics.counter('mqtt_messages_published_total', '发布成功的MQTT消息数', ['client', 'topic'])
+publish_failures = metrics.counter('mqtt_publish_failures_total', '发布失败（或超时未确认）的MQTT消息数',
+                                   ['client', 'topic'])
+message_errors = metrics.counter('mqtt_message_errors_total', '处理失败的MQTT消息数', ['client'])
+on_message_seconds = metrics.histogram('mqtt_on_message_seconds', 'on_message处理耗时', ['client'])
+connected_gauge = metrics.gauge('mqtt_connected', '当前连接状态（1为已连接）', ['client'])
+connects_total = metrics.counter('mqtt_connects_total', '连接结果计数', ['client', 'result'])
+reconnects_total = metrics.counter('mqtt_reconnects_total', '断开后重新连接成功的次数', ['client'])
+disconnects_total = metrics.counter('mqtt_disconnects_total', '连接断开次数', ['client', 'expected'])
+
+log = SampledLogger('app.mqtt')
+
 class MQTTClient:
-    def __init__(self, client_id):
+    def __init__(self, client_id, emitter=None, history=None, inference=None, network_loop=None, outbox=None,
+                 client_type=None, room=None):
         self.client = mqtt.Client(client_id=client_id, clean_session=False)
+        # loop_start线程意外断开后按指数退避自动重连（共享网络线程有自己的退避）
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
         self.connected = False
+        self.ever_connected = False
+        self.connack = threading.Event()  # 收到CONNACK（无论成功与否）时置位
         self.subscribed_topics = set()
         self.client_id = client_id
-        self.publish_queue = []
+        # 连接状态事件：浏览器按客户端类型监听，room不为None时只发给该房间（会话）
+        self.status_event = f'mqtt_connected_{client_type or client_id}'
+        self.room = room
         self.batch_size = 50
+        self.codecs = PayloadCodecs()  # 按主题选择载荷编码，默认JSON
+        self.profiles = PublishProfiles()  # 按主题选择QoS和保留策略
+        self.readings_per_message = 500  # packed编码时每条MQTT消息携带的最大读数条数
+        self.emitter = emitter or BatchEmitter()
+        self.history = history  # 按broker和主题保存收到的数据，为None时不保存
+        self.broker = None  # 连接的broker（broker_key），历史记录按它区分同名主题
+        self.inference = inference  # 流式预测，为None时不预测
+        self.network_loop = network_loop  # 共享的网络线程，为None时使用自己的loop_start线程
+        self.should_connect = False  # 为True时意外断开后由共享网络线程重连
+        self.outbox = outbox  # 断线期间保存待发消息的发件箱，为None时断线直接发布失败
+        self.replay_engine = None  # 发布端的回放引擎，由replay_engine_for创建
+        self.max_queued = 0
+        self.configure(max_inflight=self.batch_size)
+
+    def configure(self, max_inflight=None, max_queued=None):
+        """调整QoS 1/2的在途窗口和paho客户端排队消息数上限（0为不限）
+
+        publish_batch每批发送max_inflight条后统一等待确认，批次大小与在途窗口一致
+        """
+        if max_inflight is not None:
+            self.batch_size = parse_count(max_inflight, 'max_inflight', minimum=1)
+            self.client.max_inflight_messages_set(self.batch_size)
+        if max_queued is not None:
+            self.max_queued = parse_count(max_queued, 'max_queued')
+            self.client.max_queued_messages_set(self.max_queued)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"Client {self.client_id} Connected to MQTT Broker!")
+            if self.ever_connected:
+                reconnects_total.inc(client=self.client_id)
             self.connected = True
+            self.ever_connected = True
+            connects_total.inc(client=self.client_id, result='success')
+            connected_gauge.set(1, client=self.client_id)
             # 重新订阅之前的主题
             for topic in self.subscribed_topics:
                 self.client.subscribe(topic)
-            socketio.emit(f'mqtt_connected_{self.client_id}', {'status': True})
+            self.connack.set()
+            self._emit_status({'status': True})
+            if self.outbox is not None:
+                self.outbox.start_drain(self)
         else:
             print(f"Client {self.client_id} Failed to connect, return code {rc}")
             self.connected = False
-            socketio.emit(f'mqtt_connected_{self.client_id}',
-                        {'status': False, 'error': f'连接失败，错误代码：{rc}'})
+            connects_total.inc(client=self.client_id, result=str(rc))
+            connected_gauge.set(0, client=self.client_id)
+            self.connack.set()
+            self._emit_status({'status': False, 'error': f'连接失败，错误代码：{rc}'})
+
+    def _emit_status(self, data):
+        # room为空列表时没有接收方（Socket.IO会把空的to当作广播）
+        if self.room is None or self.room:
+            socketio.emit(self.status_event, data, to=self.room)
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        connected_gauge.set(0, client=self.client_id)
+        disconnects_total.inc(client=self.client_id, expected=str(rc == 0).lower())
+        if rc != 0:
+            print(f"Client {self.client_id} disconnected unexpectedly, return code {rc}")
 
     def on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        messages_received.inc(client=self.client_id, topic=msg.topic)
         try:
-            print(f"收到消息: topic={msg.topic}, payload={msg.payload}")
-            data = json.loads(msg.payload.decode())
-            data['topic'] = msg.topic
-            print(f"处理后的数据: {data}")
-            socketio.emit('new_data', data)
+            # 根据载荷头部识别JSON或packed编码，一条消息可能包含多条读数
+            for data in self.codecs.decode(msg.payload):
+                if self.history is not None:
+                    self.history.append(self.broker, msg.topic, data)
+                if self.inference is not None:
+                    self.inference.add(msg.topic, data)
+                # 交给合并推送器，按主题批量发送给浏览器
+                self.emitter.add(msg.topic, data)
+            log.debug('message', 'Client %s received message on %s', self.client_id, msg.topic)
         except Exception as e:
-            print(f"Error processing message: {e}")
+            message_errors.inc(client=self.client_id)
+            log.warning('message_error', 'Error processing message on %s: %s', msg.topic, e)
+        on_message_seconds.observe(time.perf_counter() - started, client=self.client_id)
+
+    def connect(self, broker="localhost", port=1883, timeout=5):
+        """连接broker并等待CONNACK，超时或失败返回False
 
-    def connect(self, broker="localhost", port=1883):
+        使用共享网络线程时，连接成功过的客户端再次连接失败会按退避间隔继续重试，期间发布的消息写入发件箱；
+        从未连接成功过的（地址错误、拒绝连接等）不在后台重试，直接把失败返回给调用方。
+        """
+        print(f"Attempting to connect to {broker}:{port}")
+        self.broker = broker_key(broker, port)
+        self.connack.clear()
         try:
-            print(f"Attempting to connect to {broker}:{port}")
-            self.client.connect(broker, port, keepalive=60)
-            self.client.loop_start()
-            # 等待一小段时间确保连接完成
-            time.sleep(0.5)
-            return self.connected
+            if self.network_loop is None:
+                self.client.connect(broker, port, keepalive=60)
+                self.client.loop_start()
+            else:
+                # 连接期间网络线程不能同时重连或读写这个客户端
+                self.network_loop.remove(self)
+                self.should_connect = True
+                self.client.connect(broker, port, keepalive=60)
         except Exception as e:
             print(f"Connection error: {e}")
+            if self.network_loop is not None and self.ever_connected:
+                self.network_loop.add(self)
+            else:
+                self.should_connect = False
             return False
+        if self.network_loop is not None:
+            self.network_loop.add(self)
+        self.connack.wait(timeout)
+        if not self.connected and not self.ever_connected:
+            self.disconnect()
+        return self.connected
+
+    def disconnect(self):
+        self.should_connect = False
+        # 先从共享网络线程移除，之后在本线程写出DISCONNECT，不会与网络线程同时写套接字
+        if self.network_loop is not None:
+            self.network_loop.remove(self)
+        else:
+            self.client.loop_stop()
+        self.client.disconnect()
+        if self.outbox is not None:
+            self.outbox.close()
+
+    def busy(self):
+        """正在回放或发件箱还有积压时，连接池不会把客户端当作空闲回收"""
+        replaying = self.replay_engine is not None and self.replay_engine.state in ('running', 'paused')
+        return replaying or (self.outbox is not None and self.outbox.pending())
+
+    def _should_queue(self):
+        """断线时或发件箱中还有积压时写入发件箱，保证消息按顺序发出"""
+        return self.outbox is not None and (not self.connected or self.outbox.pending())
 
     def subscribe(self, topic, qos=1):
         if not self.connected:
@@ -76,16 +198,123 @@ class MQTTClient:
             print(f"Unsubscribe error: {e}")
             return False
 
-    def publish(self, topic, message, retain=True, qos=1):
+    def publish(self, topic, message, retain=None, qos=None):
+        """发布一条消息，qos和retain为None时使用主题的发布配置"""
+        if qos is None:
+            qos = self.profiles.profile_for(topic)['qos']
+        if retain is None:
+            retain = self.profiles.should_retain(topic)
+        if self._should_queue():
+            payload, _ = self.codecs.encode(topic, [message])
+            queued = self.outbox.append(topic, payload, qos, retain)
+            if self.connected:
+                self.outbox.start_drain(self)
+            return queued
         if not self.connected:
             return False
         try:
-            result = self.client.publish(topic, json.dumps(message), qos=qos, retain=retain)
-            return result[0] == 0
+            payload, _ = self.codecs.encode(topic, [message])
+            result = self.client.publish(topic, payload, qos=qos, retain=retain)
+            if result[0] == 0:
+                messages_published.inc(client=self.client_id, topic=topic)
+                return True
+            publish_failures.inc(client=self.client_id, topic=topic)
+            return False
         except Exception as e:
             print(f"Publish error: {e}")
+            publish_failures.inc(client=self.client_id, topic=topic)
             return False
 
-# 创建两个独立的客户端实例
-publisher_client = MQTTClient('publisher')
-subscriber_client = MQTTClient('subscriber')
\ No newline at end of file
+    def publish_batch(self, topic, messages, retain=None, qos=None, ack_timeout=10):
+        """批量发布消息，qos和retain为None时使用主题的发布配置
+
+        消息先按主题的编码打包（JSON每条一个MQTT消息，packed每readings_per_message条一个），
+        每次调用使用自己的队列（并发调用互不影响），按batch_size分批流水线发布：一个批次内的MQTT消息连续发出，
+        之后统一等待PUBACK，返回每批的确认情况（按读数条数统计）。
+        断线或发件箱有积压时消息写入发件箱，queued为写入的读数条数。
+        """
+        if qos is None:
+            qos = self.profiles.profile_for(topic)['qos']
+        if retain is None:
+            retain = self.profiles.should_retain(topic)
+        if self._should_queue():
+            return [self._queue_batch(topic, messages, retain, qos)]
+        if not self.connected:
+            return None
+        queue = self._pack(topic, messages)
+        batches = []
+        # QoS 0没有确认可等，一次全部发出
+        batch_size = self.batch_size if qos > 0 else max(len(queue), 1)
+        for start in range(0, len(queue), batch_size):
+            batch = queue[start:start + batch_size]
+            is_last = start + batch_size >= len(queue)
+            infos = []
+            failed = 0
+            for i, (payload, count) in enumerate(batch):
+                try:
+                    # 只保留最后一条消息作为主题的最新状态
+                    info = self.client.publish(topic, payload, qos=qos,
+                                               retain=retain and is_last and i == len(batch) - 1)
+                    if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                        infos.append((info, count))
+                    else:
+                        failed += count
+                except Exception as e:
+                    log.warning('publish_error', 'Publish error on %s: %s', topic, e)
+                    failed += count
+            sent = sum(count for _, count in infos)
+            acked = self._wait_for_acks(infos, ack_timeout) if qos > 0 else sent
+            total = sum(count for _, count in batch)
+            messages_published.inc(acked, client=self.client_id, topic=topic)
+            if total > acked:
+                publish_failures.inc(total - acked, client=self.client_id, topic=topic)
+            batches.append({
+                'batch': len(batches),
+                'sent': sent,
+                'acked': acked,
+                'queued': 0,
+                'failed': failed
+            })
+        return batches
+
+    def _queue_batch(self, topic, messages, retain, qos):
+        packed = self._pack(topic, messages)
+        queued = failed = 0
+        for i, (payload, count) in enumerate(packed):
+            if self.outbox.append(topic, payload, qos, retain and i == len(packed) - 1):
+                queued += count
+            else:
+                failed += count
+        if self.connected:
+            self.outbox.start_drain(self)
+        return {'batch': 0, 'sent': 0, 'acked': 0, 'queued': queued, 'failed': failed}
+
+    def _pack(self, topic, messages):
+        """把消息编码为[(载荷, 包含的读数条数)]"""
+        if self.codecs.codec_for(topic).name == 'json':
+            return [(json.dumps(message), 1) for message in messages]
+        packed = []
+        for i in range(0, len(messages), self.readings_per_message):
+            chunk = messages[i:i + self.readings_per_message]
+            payload, codec = self.codecs.encode(topic, chunk)
+            if codec == 'json':
+                # 无法打包时逐条用JSON发送
+                packed.extend((json.dumps(message), 1) for message in chunk)
+            else:
+                packed.append((payload, len(chunk)))
+        return packed
+
+    def _wait_for_acks(self, infos, timeout):
+        """等待一批消息的确认，infos为[(MQTTMessageInfo, 读数条数)]，返回在超时前确认的读数条数"""
+        deadline = time.time() + timeout
+        acked = 0
+        for info, count in infos:
+            remaining = deadline - time.time()
+            if remaining > 0:
+                try:
+                    info.wait_for_publish(timeout=remaining)
+                except (ValueError, RuntimeError):
+                    pass
+            if info.is_published():
+                acked += count
+        return acked
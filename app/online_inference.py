@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from app.emitter import topic_rooms
+from app.history import reading_value
+from app.prediction import WeatherPredictor
+from src.forecasting import rollout_forecast
+from src.model_registry import model_registry
+
+
+class OnlineInference:
+    """订阅端的流式预测
+
+    MQTT网络线程只把读数追加到待处理列表；后台线程每个周期取出所有主题的新读数，
+    更新各主题的滚动窗口，窗口满seq_length个点后用该主题在模型仓库中的最新模型预测下一个值。
+    同一周期内所有窗口按模型合并成一个批次推理，结果以prediction事件推送给订阅了该主题的浏览器。
+    """
+
+    def __init__(self, registry=model_registry, event='prediction', tick_interval=0.05, steps=1,
+                 max_pending=5000, max_windows_per_topic=64, model_refresh_interval=5.0, rooms=topic_rooms):
+        self.registry = registry
+        self.rooms = rooms
+        self.event = event
+        self.tick_interval = tick_interval
+        self.steps = steps
+        self.max_pending = max_pending
+        # 每个周期每个主题最多预测的窗口数，积压时只预测最新的读数
+        self.max_windows_per_topic = max_windows_per_topic
+        self.model_refresh_interval = model_refresh_interval
+        self.predictor = WeatherPredictor(registry=None)
+        self.pending = {}
+        self.dropped = {}
+        self.windows = {}
+        self.models = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, topic, data):
+        """加入一条读数，不阻塞调用线程"""
+        with self.lock:
+            queue = self.pending.get(topic)
+            if queue is None:
+                queue = self.pending[topic] = deque(maxlen=self.max_pending)
+            if len(queue) == self.max_pending:
+                self.dropped[topic] = self.dropped.get(topic, 0) + 1
+            queue.append((data.get('time'), reading_value(data)))
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _model_for(self, topic):
+        """主题当前使用的模型，定期检查仓库中是否有更新的版本"""
+        now = time.time()
+        cached = self.models.get(topic)
+        if cached is not None and now - cached['checked_at'] < self.model_refresh_interval:
+            return cached['entry']
+        fingerprint = self.registry.latest_fingerprint(topic)
+        if cached is not None and cached['fingerprint'] == fingerprint:
+            entry = cached['entry']
+        else:
+            entry = self.registry.load(topic, fingerprint, self.predictor.build_model) if fingerprint else None
+        self.models[topic] = {'fingerprint': fingerprint, 'entry': entry, 'checked_at': now}
+        return entry
+
+    def _window_for(self, topic, seq_length):
+        window = self.windows.get(topic)
+        if window is None or window.maxlen != seq_length:
+            window = self.windows[topic] = deque(window or (), maxlen=seq_length)
+        return window
+
+    def process(self):
+        """处理一个周期内收到的所有读数，返回推送的预测条数"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            dropped, self.dropped = self.dropped, {}
+
+        # 按模型分组：同一模型的窗口合并为一次推理
+        groups = {}
+        for topic, queue in pending.items():
+            times, values = zip(*queue)
+            values = np.array(values, dtype=np.float64)
+            valid = ~np.isnan(values)
+            times = [t for t, ok in zip(times, valid) if ok]
+            values = values[valid]
+            if not len(values):
+                continue
+
+            entry = self._model_for(topic)
+            seq_length = entry['meta']['seq_length'] if entry is not None else 24
+            window = self._window_for(topic, seq_length)
+            history = np.concatenate([np.array(window, dtype=np.float64), values])
+            window.extend(values[-seq_length:])
+            # 没有浏览器订阅该主题时只更新窗口，不做推理
+            if entry is None or len(history) < seq_length or not self.rooms.rooms_for(topic):
+                continue
+
+            # 以每条新读数结尾的窗口
+            windows = sliding_window_view(history, seq_length)[-len(values):][-self.max_windows_per_topic:]
+            times = times[-len(windows):]
+            scaled = entry['scaler'].transform(windows.reshape(-1, 1)).reshape(windows.shape)
+            group = groups.setdefault(id(entry['model']), {'entry': entry, 'parts': []})
+            group['parts'].append((topic, times, scaled))
+
+        emitted = 0
+        for group in groups.values():
+            entry = group['entry']
+            batch = np.concatenate([scaled for _, _, scaled in group['parts']])
+            predictions = rollout_forecast(entry['model'], batch, self.steps)
+            predictions = entry['scaler'].inverse_transform(predictions.reshape(-1, 1)).reshape(predictions.shape)
+            offset = 0
+            for topic, times, scaled in group['parts']:
+                topic_predictions = predictions[offset:offset + len(scaled)]
+                offset += len(scaled)
+                self.rooms.emit(self.event, {
+                    'topic': topic,
+                    'model': entry['meta'].get('fingerprint'),
+                    'items': [{'time': t, 'predictions': p.tolist()} for t, p in zip(times, topic_predictions)],
+                    'dropped': dropped.get(topic, 0)
+                }, topic)
+                emitted += len(scaled)
+        return emitted
+
+    def _run(self):
+        while True:
+            started = time.time()
+            try:
+                self.process()
+            except Exception as e:
+                print(f"Online inference error: {e}")
+            time.sleep(max(0.0, self.tick_interval - (time.time() - started)))
+
+
+online_inference = OnlineInference()
@@ -0,0 +1,240 @@
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import paho.mqtt.client as mqtt
+from app.metrics import metrics
+
+OUTBOX_DIR = os.path.join(tempfile.gettempdir(), 'mqtt_outbox')
+
+outbox_queued = metrics.counter('mqtt_outbox_queued_total', '写入发件箱的MQTT消息数', ['client'])
+outbox_dropped = metrics.counter('mqtt_outbox_dropped_total', '发件箱已满被丢弃的MQTT消息数', ['client'])
+outbox_drained = metrics.counter('mqtt_outbox_drained_total', '从发件箱补发并确认的MQTT消息数', ['client'])
+outbox_backlog = metrics.gauge('mqtt_outbox_backlog', '发件箱中待补发的MQTT消息数', ['client'])
+
+
+def expire_outboxes(directory=OUTBOX_DIR, max_age=7 * 24 * 3600, keep=()):
+    """删除超过max_age秒没有写入的发件箱文件（会话不再回来时的积压），keep中的路径不删除，返回删除的文件数"""
+    deadline = time.time() - max_age
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if not name.endswith('.log'):
+            continue
+        path = os.path.join(directory, name)
+        if path in keep:
+            continue
+        try:
+            if os.path.getmtime(path) >= deadline:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        for suffix in ('.offset', '.offset.tmp'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+class Outbox:
+    """断线期间的磁盘发件箱
+
+    消息按顺序追加写入<directory>/<name>.log，每条记录为
+    载荷长度(I) 主题长度(H) qos(B) retain(?) + 主题 + 载荷；
+    已确认发送的位置保存在<name>.log.offset中，进程重启后从该位置继续补发，全部补发后清空文件。
+    文件大小超过max_bytes时丢弃新消息。
+
+    重新连接后由后台线程按drain_batch条一批流水线补发，每批等待PUBACK，
+    补发速率不超过drain_rate条/秒，避免积压的消息瞬间压垮broker。
+    批次大小不超过客户端的在途窗口和排队上限；发布被拒绝或确认超时时按退避间隔重试，直到断线或补发完成。
+    """
+
+    RECORD = struct.Struct('<IHB?')
+
+    def __init__(self, name, directory=OUTBOX_DIR, max_bytes=64 * 1024 * 1024, drain_batch=500,
+                 drain_rate=2000, ack_timeout=10, retry_delay=(0.5, 30)):
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.path = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]+', '_', name) + '.log')
+        self.offset_path = self.path + '.offset'
+        self.max_bytes = max_bytes
+        self.drain_batch = drain_batch
+        self.drain_rate = drain_rate
+        self.ack_timeout = ack_timeout
+        self.min_retry_delay, self.max_retry_delay = retry_delay
+        self.lock = threading.Lock()
+        self.file = None
+        self.thread = None
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.offset = min(self._load_offset(), self.size)
+        self.backlog = self._count_records()
+        outbox_backlog.set(self.backlog, client=self.name)
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_offset(self):
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(self.offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def _count_records(self):
+        """统计offset之后的完整记录数，截掉进程崩溃时写了一半的记录"""
+        count = 0
+        position = self.offset
+        if self.size > position:
+            with open(self.path, 'rb') as f:
+                f.seek(position)
+                while True:
+                    header = f.read(self.RECORD.size)
+                    if len(header) < self.RECORD.size:
+                        break
+                    payload_length, topic_length, _, _ = self.RECORD.unpack(header)
+                    end = position + self.RECORD.size + topic_length + payload_length
+                    if end > self.size:
+                        break
+                    f.seek(end)
+                    position = end
+                    count += 1
+        if position < self.size:
+            with open(self.path, 'r+b') as f:
+                f.truncate(position)
+            self.size = position
+        return count
+
+    def pending(self):
+        return self.backlog > 0
+
+    def append(self, topic, payload, qos=1, retain=False):
+        """追加一条消息，发件箱已满时返回False"""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        encoded_topic = topic.encode('utf-8')
+        record = self.RECORD.pack(len(payload), len(encoded_topic), qos, retain) + encoded_topic + payload
+        with self.lock:
+            if self.size + len(record) > self.max_bytes:
+                outbox_dropped.inc(client=self.name)
+                return False
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+            self.file.write(record)
+            # 只刷新到操作系统缓冲区，每条fsync会让断线期间的发布速度下降几个数量级
+            self.file.flush()
+            self.size += len(record)
+            self.backlog += 1
+            outbox_queued.inc(client=self.name)
+            outbox_backlog.set(self.backlog, client=self.name)
+            return True
+
+    def _read_batch(self, limit):
+        """从offset读取最多limit条记录，返回[(主题, 载荷, qos, retain, 记录结束位置)]"""
+        with self.lock:
+            offset, size = self.offset, self.size
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while len(records) < limit and offset < size:
+                payload_length, topic_length, qos, retain = self.RECORD.unpack(f.read(self.RECORD.size))
+                topic = f.read(topic_length).decode('utf-8')
+                payload = f.read(payload_length)
+                offset += self.RECORD.size + topic_length + payload_length
+                records.append((topic, payload, qos, retain, offset))
+        return records
+
+    def _advance(self, offset, count):
+        with self.lock:
+            self.offset = offset
+            self.backlog -= count
+            if self.offset >= self.size:
+                # 全部补发完成，清空文件避免无限增长
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                open(self.path, 'wb').close()
+                self.offset = self.size = 0
+            self._save_offset()
+            outbox_backlog.set(self.backlog, client=self.name)
+
+    def start_drain(self, mqtt_client):
+        """在后台线程中补发积压的消息（不能在paho的网络线程中等待PUBACK）"""
+        with self.lock:
+            if not self.backlog or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = threading.Thread(target=self._drain, args=(mqtt_client,), daemon=True,
+                                           name=f'outbox-{self.name}')
+        self.thread.start()
+
+    def _batch_limit(self, mqtt_client):
+        # 超过paho的排队上限的消息会被拒绝（MQTT_ERR_QUEUE_SIZE），超过在途窗口的只是在本地排队
+        limit = min(self.drain_batch, mqtt_client.batch_size)
+        if mqtt_client.max_queued:
+            limit = min(limit, mqtt_client.max_queued)
+        return max(limit, 1)
+
+    def _drain(self, mqtt_client):
+        retry_delay = self.min_retry_delay
+        while mqtt_client.connected:
+            records = self._read_batch(self._batch_limit(mqtt_client))
+            if not records:
+                # 补发期间可能有新消息写入，退出前再检查一次
+                with self.lock:
+                    if not self.backlog:
+                        self.thread = None
+                        return
+                continue
+            started = time.time()
+            infos = []
+            for topic, payload, qos, retain, end in records:
+                info = mqtt_client.client.publish(topic, payload, qos=qos, retain=retain)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                infos.append((info, end))
+
+            # 只推进到第一条未确认的消息，其后的消息下次重新补发（至少一次）
+            deadline = started + self.ack_timeout
+            acked_offset, acked = None, 0
+            for info, end in infos:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    try:
+                        info.wait_for_publish(timeout=remaining)
+                    except (ValueError, RuntimeError):
+                        pass
+                if not info.is_published():
+                    break
+                acked_offset, acked = end, acked + 1
+            if acked_offset is not None:
+                self._advance(acked_offset, acked)
+                outbox_drained.inc(acked, client=self.name)
+            if not acked:
+                # 一条都没有发出（被拒绝或确认超时）：连接仍在时退避后重试
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                continue
+            # 部分确认时从第一条未确认的消息继续
+            retry_delay = self.min_retry_delay
+
+            delay = started + acked / self.drain_rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        with self.lock:
+            self.thread = None
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
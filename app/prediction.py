@@ -4,42 +4,81 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error
+import threading
+from collections import OrderedDict
+from src.model_registry import ModelRegistry, model_registry
+from src.windowing import sliding_windows, fit_windows, predict_windows
+from src.forecasting import rollout_forecast
+
+# 已缩放、已构建窗口的数据缓存：(数据指纹, seq_length) -> (scaler, X, y)
+_prepared_cache = OrderedDict()
+_prepared_lock = threading.Lock()
+PREPARED_CACHE_SIZE = 8
 
 class WeatherPredictor:
-    def __init__(self):
+    def __init__(self, registry=model_registry):
         self.model = None
         self.scaler = MinMaxScaler()
         self.seq_length = 24  # 默认序列长度
+        self.registry = registry  # 模型仓库，为None时每次都重新训练
         
     def prepare_sequences(self, data, seq_length):
-        """准备序列数据"""
-        sequences = []
-        targets = []
+        """准备序列数据（滑动窗口视图，不复制重叠数据）"""
+        return sliding_windows(data, seq_length)
+    
+    def prepare_data(self, values, seq_length):
+        """缩放数据并构建窗口，同一数据重复预测时直接复用缓存的结果"""
+        key = (ModelRegistry.fingerprint(values), seq_length)
+        with _prepared_lock:
+            cached = _prepared_cache.get(key)
+            if cached is not None:
+                _prepared_cache.move_to_end(key)
+                return cached
         
-        for i in range(len(data) - seq_length):
-            seq = data[i:i + seq_length]
-            target = data[i + seq_length]
-            sequences.append(seq)
-            targets.append(target)
-            
-        return np.array(sequences), np.array(targets)
+        scaler = MinMaxScaler()
+        scaled_data = scaler.fit_transform(np.asarray(values, dtype=float).reshape(-1, 1))
+        X, y = self.prepare_sequences(scaled_data, seq_length)
+        with _prepared_lock:
+            _prepared_cache[key] = (scaler, X, y)
+            while len(_prepared_cache) > PREPARED_CACHE_SIZE:
+                _prepared_cache.popitem(last=False)
+        return scaler, X, y
     
-    def train_lstm(self, data, seq_length=24, train_split=0.8, epochs=20, batch_size=16):
+    def build_model(self, seq_length):
+        """构建LSTM模型"""
+        model = Sequential([
+            LSTM(50, activation='relu', input_shape=(seq_length, 1), return_sequences=True),
+            LSTM(50, activation='relu'),
+            Dense(25, activation='relu'),
+            Dense(1)
+        ])
+        model.compile(optimizer='adam', loss='mse')
+        return model
+    
+    def train_lstm(self, data, seq_length=24, train_split=0.8, epochs=20, batch_size=16, callbacks=None, verbose=1,
+                   topic=None):
         """
         训练LSTM模型并返回预测结果
+        callbacks: 传给model.fit的Keras回调（例如推送训练进度）
+        topic: 指定时先在模型仓库中查找相同主题和相同数据训练过的模型，找到则直接复用
         """
         try:
             # 确保数据按时间戳排序
             data = data.sort_index()
+            self.seq_length = seq_length
             
-            # 数据标准化
-            scaled_data = self.scaler.fit_transform(data.values.reshape(-1, 1))
-            
-            # 准备序列数据
-            X, y = self.prepare_sequences(scaled_data, seq_length)
+            # 查找已训练的模型
+            entry = None
+            fingerprint = None
+            if topic is not None and self.registry is not None:
+                hyperparams = {'seq_length': seq_length, 'train_split': train_split,
+                               'epochs': epochs, 'batch_size': batch_size}
+                fingerprint = self.registry.fingerprint(data.values, model='app_lstm', **hyperparams)
+                entry = self.registry.load(topic, fingerprint, self.build_model)
             
-            # 重塑数据以适应LSTM输入格式 (samples, time steps, features)
-            X = X.reshape((X.shape[0], X.shape[1], 1))
+            # 数据标准化并准备序列数据，X的形状为LSTM输入格式 (samples, time steps, features)
+            # 仓库中的模型与当前数据指纹相同，其缩放器与这里拟合的一致
+            self.scaler, X, y = self.prepare_data(data.values, seq_length)
             
             # 划分训练集和测试集
             train_size = int(len(X) * train_split)
@@ -51,28 +90,37 @@ class WeatherPredictor:
             self.train_timestamps = self.timestamps[:train_size]
             self.test_timestamps = self.timestamps[train_size:]
             
-            # 构建模型
-            self.model = Sequential([
-                LSTM(50, activation='relu', input_shape=(seq_length, 1), return_sequences=True),
-                LSTM(50, activation='relu'),
-                Dense(25, activation='relu'),
-                Dense(1)
-            ])
-            
-            self.model.compile(optimizer='adam', loss='mse')
-            
-            # 训练模型
-            self.model.fit(
-                X_train, y_train,
-                epochs=epochs,
-                batch_size=batch_size,
-                validation_split=0.1,
-                verbose=1
-            )
+            # 仓库中的版本号：复用的模型沿用其版本，新训练的模型分配新版本
+            version = entry['meta'].get('version') if entry is not None else None
+            if entry is not None:
+                self.model = entry['model']
+            else:
+                # 构建并训练模型
+                self.model = self.build_model(seq_length)
+                fit_windows(
+                    self.model, X_train, y_train,
+                    epochs=epochs,
+                    batch_size=batch_size,
+                    validation_split=0.1,
+                    callbacks=callbacks,
+                    verbose=verbose
+                )
+                if fingerprint is not None:
+                    # 版本号分配和保存在同一把锁内，并发训练不会得到相同的版本号
+                    with self.registry.topic_lock(topic):
+                        version = self.registry.next_version(topic)
+                        self.registry.save(topic, fingerprint, self.model, self.scaler, seq_length, hyperparams,
+                                           latest=True, version=version,
+                                           trained_until=str(self.train_timestamps[-1]), mode='full')
+            if entry is not None and topic is not None:
+                # 复用的模型也成为主题的最新模型（增量更新和流式预测都从latest.json开始）
+                with self.registry.topic_lock(topic):
+                    if self.registry.latest_fingerprint(topic) != fingerprint:
+                        self.registry.set_latest(topic, fingerprint)
             
             # 预测
-            train_pred = self.model.predict(X_train)
-            test_pred = self.model.predict(X_test)
+            train_pred = predict_windows(self.model, X_train, verbose=verbose)
+            test_pred = predict_windows(self.model, X_test, verbose=verbose)
             
             # 反标准化
             train_pred = self.scaler.inverse_transform(train_pred)
@@ -86,13 +134,106 @@ class WeatherPredictor:
                 'y_train': y_train_orig,
                 'y_test': y_test_orig,
                 'train_timestamps': self.train_timestamps,
-                'test_timestamps': self.test_timestamps
+                'test_timestamps': self.test_timestamps,
+                'from_registry': entry is not None,
+                'version': version
             }
             
         except Exception as e:
             print(f"训练过程出错: {str(e)}")
             raise e
     
+    def scaler_drifted(self, scaler, values, tolerance=0.1):
+        """数据范围超出缩放器范围的tolerance倍时认为发生漂移"""
+        data_min, data_max = scaler.data_min_[0], scaler.data_max_[0]
+        margin = tolerance * max(data_max - data_min, 1e-12)
+        return np.nanmin(values) < data_min - margin or np.nanmax(values) > data_max + margin
+    
+    def update_lstm(self, data, topic, seq_length=24, train_split=0.8, epochs=3, batch_size=16, replay_ratio=1.0,
+                    drift_tolerance=0.1, full_epochs=20, callbacks=None, verbose=1):
+        """
+        增量更新主题的LSTM模型并返回预测结果
+        加载主题最新的模型和缩放器，只用新数据产生的窗口加上同样数量的旧窗口（回放样本）
+        微调几个epoch，训练成本与新数据量成正比；没有旧模型、序列长度变化或数据范围
+        漂移（超出缩放器范围drift_tolerance倍）时重新缩放并完整训练。
+        与train_lstm一样，最近的(1 - train_split)部分窗口只用于评估，不参与微调，
+        留到以后的更新中再训练。同一主题的更新串行执行，版本号不会冲突。
+        """
+        if self.registry is None:
+            raise ValueError('增量更新需要模型仓库')
+        with self.registry.topic_lock(topic):
+            return self._update_lstm(data, topic, seq_length, train_split, epochs, batch_size, replay_ratio,
+                                     drift_tolerance, full_epochs, callbacks, verbose)
+
+    def _update_lstm(self, data, topic, seq_length, train_split, epochs, batch_size, replay_ratio,
+                     drift_tolerance, full_epochs, callbacks, verbose):
+        data = data.sort_index()
+        previous = self.registry.latest(topic, self.build_model)
+        if previous is None or previous['meta']['seq_length'] != seq_length \
+                or 'trained_until' not in previous['meta'] \
+                or self.scaler_drifted(previous['scaler'], data.values, drift_tolerance):
+            results = self.train_lstm(data, seq_length, train_split, full_epochs, batch_size,
+                                      callbacks=callbacks, verbose=verbose, topic=topic)
+            results['mode'] = 'full' if not results['from_registry'] else 'unchanged'
+            return results
+        
+        self.seq_length = seq_length
+        self.scaler = previous['scaler']
+        scaled_data = self.scaler.transform(data.values.reshape(-1, 1))
+        X, y = self.prepare_sequences(scaled_data, seq_length)
+        self.timestamps = data.index[seq_length:].values
+        
+        # 与train_lstm相同的训练集/测试集划分：最近的窗口留作评估，不参与微调
+        train_size = int(len(X) * train_split)
+        X_train, X_test = X[:train_size], X[train_size:]
+        y_train, y_test = y[:train_size], y[train_size:]
+        self.train_timestamps = self.timestamps[:train_size]
+        self.test_timestamps = self.timestamps[train_size:]
+        
+        # 训练集中目标时间晚于上次训练数据的窗口为新窗口（数据已排序，位于末尾）
+        trained_until = np.datetime64(pd.Timestamp(previous['meta']['trained_until']))
+        first_new = int(np.searchsorted(self.timestamps[:train_size], trained_until, side='right'))
+        new_count = train_size - first_new
+        
+        if new_count > 0:
+            # 复制旧模型权重再微调，仓库中缓存的旧模型保持不变
+            self.model = self.build_model(seq_length)
+            self.model.set_weights(previous['model'].get_weights())
+            replay_count = min(first_new, int(np.ceil(new_count * replay_ratio)))
+            replay = np.random.choice(first_new, replay_count, replace=False) if replay_count else np.array([], dtype=int)
+            indices = np.concatenate([replay, np.arange(first_new, train_size)])
+            fit_windows(self.model, X[indices], y[indices], epochs=epochs, batch_size=batch_size,
+                        validation_split=0.0, callbacks=callbacks, verbose=verbose)
+            
+            # 在主题锁内分配，期间完整训练保存的版本也会被计入
+            version = self.registry.next_version(topic)
+            fingerprint = self.registry.fingerprint(data.values, model='app_lstm', mode='update', version=version,
+                                                    parent=previous['meta']['fingerprint'])
+            hyperparams = {'seq_length': seq_length, 'epochs': epochs, 'batch_size': batch_size,
+                           'replay_ratio': replay_ratio}
+            self.registry.save(topic, fingerprint, self.model, self.scaler, seq_length, hyperparams,
+                               latest=True, version=version, trained_until=str(self.train_timestamps[-1]),
+                               mode='update', parent=previous['meta']['fingerprint'], new_windows=new_count)
+        else:
+            self.model = previous['model']
+            version = previous['meta'].get('version', 0)
+        
+        train_pred = predict_windows(self.model, X_train, verbose=verbose)
+        test_pred = predict_windows(self.model, X_test, verbose=verbose)
+        
+        return {
+            'train_pred': self.scaler.inverse_transform(train_pred),
+            'test_pred': self.scaler.inverse_transform(test_pred),
+            'y_train': self.scaler.inverse_transform(y_train.reshape(-1, 1)),
+            'y_test': self.scaler.inverse_transform(y_test.reshape(-1, 1)),
+            'train_timestamps': self.train_timestamps,
+            'test_timestamps': self.test_timestamps,
+            'from_registry': True,
+            'mode': 'update' if new_count > 0 else 'unchanged',
+            'version': version,
+            'new_windows': max(new_count, 0)
+        }
+    
     def evaluate_model(self, y_true, y_pred):
         """评估模型性能"""
         mse = mean_squared_error(y_true, y_pred)
@@ -106,17 +247,11 @@ class WeatherPredictor:
         }
     
     def predict_future(self, data, steps=24):
-        """预测未来数据"""
+        """预测未来数据（缩放一次后在编译好的图中完成全部步数的滚动预测）"""
         if self.model is None:
             raise ValueError("模型尚未训练")
             
-        last_sequence = data[-self.seq_length:].values.reshape(1, -1, 1)
-        predictions = []
-        
-        for _ in range(steps):
-            next_pred = self.model.predict(last_sequence)
-            predictions.append(next_pred[0, 0])
-            last_sequence = np.roll(last_sequence, -1)
-            last_sequence[0, -1, 0] = next_pred
+        last_sequence = self.scaler.transform(np.asarray(data[-self.seq_length:], dtype=float).reshape(-1, 1))
+        predictions = rollout_forecast(self.model, last_sequence.ravel(), steps)
             
-        return self.scaler.inverse_transform(np.array(predictions).reshape(-1, 1)) 
\ No newline at end of file
+        return self.scaler.inverse_transform(predictions.reshape(-1, 1))
\ No newline at end of file
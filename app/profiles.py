@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+from paho.mqtt.client import topic_matches_sub
+
+# retain_interval：每隔多少秒把一条消息作为主题的最新状态保留，0表示每条都保留，None表示从不保留
+PROFILES = {
+    # 高频遥测：QoS 0，不等待PUBACK
+    'telemetry': {'qos': 0, 'retain_interval': 5.0},
+    # 需要确认送达的数据，保留消息只定期更新
+    'reliable': {'qos': 1, 'retain_interval': 5.0},
+    # 每条消息都保留（低频的状态类主题）
+    'state': {'qos': 1, 'retain_interval': 0},
+}
+
+
+def parse_qos(qos):
+    """QoS必须是整数0、1或2（布尔值和小数无效）"""
+    if isinstance(qos, bool) or not isinstance(qos, int) or qos not in (0, 1, 2):
+        raise ValueError(f'无效的QoS: {qos!r}')
+    return qos
+
+
+def parse_retain(retain):
+    """retain必须是布尔值或None（字符串"false"不能当作True）"""
+    if retain is not None and not isinstance(retain, bool):
+        raise ValueError(f'无效的retain: {retain!r}')
+    return retain
+
+
+def parse_count(value, name, minimum=0, maximum=None):
+    """解析整数参数（表单中的数字字符串也可以），拒绝布尔值、小数、无穷大和超出范围的值"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name}必须是整数: {value!r}')
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(f'{name}超出范围: {value}')
+    return value
+
+
+class PublishProfiles:
+    """按主题选择发布的QoS和保留策略
+
+    broker每收到一条保留消息都要替换主题的保留状态，高频数据逐条保留没有意义，
+    因此只每retain_interval秒保留一条作为“最新状态”快照。
+    """
+
+    def __init__(self, default='reliable'):
+        self.profiles = dict(PROFILES)
+        self.default = default
+        self.rules = []  # [(主题过滤器, 配置名)]，后设置的优先（单个主题的配置可以覆盖之前的通配符规则）
+        self.cache = {}
+        self.last_retained = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _validate(profile):
+        qos = parse_qos(profile.get('qos', 1))
+        interval = profile.get('retain_interval')
+        if interval is not None and (isinstance(interval, bool) or not isinstance(interval, (int, float))
+                                     or not math.isfinite(interval) or interval < 0):
+            raise ValueError(f'无效的保留间隔: {interval!r}')
+        return {'qos': qos, 'retain_interval': None if interval is None else float(interval)}
+
+    @classmethod
+    def check(cls, topic_filter, profile):
+        """校验主题过滤器和配置（配置名或{'qos', 'retain_interval'}），返回校验后的配置"""
+        if not isinstance(topic_filter, str) or not topic_filter:
+            raise ValueError(f'无效的主题过滤器: {topic_filter!r}')
+        if isinstance(profile, dict):
+            return cls._validate(profile)
+        if not isinstance(profile, str):
+            raise ValueError(f'无效的发布配置: {profile!r}')
+        return profile
+
+    def set_profile(self, topic_filter, profile):
+        """为主题过滤器设置配置，profile为配置名或{'qos', 'retain_interval'}"""
+        profile = self.check(topic_filter, profile)
+        if isinstance(profile, dict):
+            name = f'custom:{topic_filter}'
+        else:
+            name = profile
+            if name not in self.profiles:
+                raise ValueError(f'未知的发布配置: {name}')
+        with self.lock:
+            if isinstance(profile, dict):
+                self.profiles[name] = profile
+            self.rules = [(topic_filter, name)] + [(f, n) for f, n in self.rules if f != topic_filter]
+            self.cache.clear()
+
+    def profile_for(self, topic):
+        with self.lock:
+            name = self.cache.get(topic)
+            if name is None:
+                name = next((n for f, n in self.rules if topic_matches_sub(f, topic)), self.default)
+                self.cache[topic] = name
+            return self.profiles[name]
+
+    def should_retain(self, topic):
+        """本次发布是否作为保留消息，每个主题每retain_interval秒最多一次"""
+        interval = self.profile_for(topic)['retain_interval']
+        if interval is None:
+            return False
+        now = time.time()
+        with self.lock:
+            if now - self.last_retained.get(topic, float('-inf')) < interval:
+                return False
+            self.last_retained[topic] = now
+            return True
@@ -0,0 +1,176 @@
+import math
+import os
+import threading
+import time
+from itertools import islice
+import numpy as np
+from app import socketio
+from src.data_processor import parse_lines
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+
+
+def iter_readings(path, chunk_lines=256):
+    """分块读取数据文件，按需生成(读取字节数, 消息)，内存占用与文件大小无关"""
+    with open(path, 'rb') as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            # 保持文件中的原始顺序
+            timestamps, values = parse_lines(lines, sort=False)
+            position = f.tell()
+            for timestamp, value in zip(np.datetime_as_string(timestamps, unit='s'), values.tolist()):
+                yield position, {
+                    'temperature': value,
+                    'humidity': 0,
+                    'time': timestamp
+                }
+
+
+def resolve_data_path(path):
+    """将相对路径解析到data目录下，拒绝目录之外的路径"""
+    full_path = os.path.realpath(os.path.join(DATA_DIR, path))
+    if os.path.commonpath([full_path, DATA_DIR]) != DATA_DIR or not os.path.isfile(full_path):
+        raise ValueError(f'数据文件不存在: {path}')
+    return full_path
+
+
+class ReplayEngine:
+    """服务器端数据回放：按目标速率把文件流式发布到MQTT"""
+
+    def __init__(self, client, progress_interval=0.5):
+        self.client = client
+        self.progress_interval = progress_interval
+        self.thread = None
+        self.running = threading.Event()
+        self.resumed = threading.Event()
+        self.state = 'idle'
+        self.stats = {}
+
+    def is_active(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, path, topic, rate=0, remove_after=False):
+        """开始回放，rate为每秒消息数，0表示尽可能快；remove_after为True时回放结束后删除文件（上传的临时文件）"""
+        if self.is_active():
+            raise RuntimeError('回放正在进行中')
+        if not math.isfinite(rate) or rate < 0:
+            raise ValueError(f'无效的速率: {rate}')
+        self.running.set()
+        self.resumed.set()
+        self.state = 'running'
+        self.stats = {
+            'file': os.path.basename(path),
+            'topic': topic,
+            'rate': rate,
+            'published': 0,
+            'queued': 0,
+            'failed': 0,
+            'bytes_read': 0,
+            'total_bytes': os.path.getsize(path),
+            'elapsed': 0.0
+        }
+        self.thread = threading.Thread(target=self._run, args=(path, topic, rate, remove_after), daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        if self.state == 'running':
+            self.resumed.clear()
+            self.state = 'paused'
+            self._emit_progress()
+
+    def resume(self):
+        if self.state == 'paused':
+            self.state = 'running'
+            self.resumed.set()
+
+    def stop(self):
+        self.running.clear()
+        self.resumed.set()
+
+    def status(self):
+        return dict(self.stats, state=self.state)
+
+    def _run(self, path, topic, rate, remove_after=False):
+        # 按速率计算每批大小，尽可能快时使用客户端的完整批次
+        batch_size = self.client.batch_size if rate <= 0 else max(1, min(self.client.batch_size, int(rate / 10)))
+        start_time = time.time()
+        paused_time = 0.0
+        last_emit = 0.0
+        batch = []
+        try:
+            for position, message in iter_readings(path):
+                batch.append(message)
+                self.stats['bytes_read'] = position
+                if len(batch) < batch_size:
+                    continue
+                paused_time += self._wait_if_paused()
+                if not self.running.is_set():
+                    break
+                self._publish(topic, batch)
+                batch = []
+                if rate > 0:
+                    # 按目标速率计算下一批的发送时间
+                    sent = self.stats['published'] + self.stats['queued'] + self.stats['failed']
+                    delay = start_time + paused_time + sent / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                now = time.time()
+                self.stats['elapsed'] = now - start_time - paused_time
+                if now - last_emit >= self.progress_interval:
+                    last_emit = now
+                    self._emit_progress()
+            if batch and self.running.is_set():
+                self._publish(topic, batch)
+            self.state = 'finished' if self.running.is_set() else 'stopped'
+        except Exception as e:
+            print(f"Replay error: {e}")
+            self.stats['error'] = str(e)
+            self.state = 'error'
+        finally:
+            self.running.clear()
+            self.stats['elapsed'] = time.time() - start_time - paused_time
+            if remove_after:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._emit_progress()
+
+    def _wait_if_paused(self):
+        """暂停时阻塞，返回暂停时长"""
+        if self.resumed.is_set():
+            return 0.0
+        paused_at = time.time()
+        self.resumed.wait()
+        return time.time() - paused_at
+
+    def _publish(self, topic, batch):
+        batches = self.client.publish_batch(topic, batch)
+        if batches is None:
+            raise RuntimeError('未连接到MQTT服务器')
+        acked = sum(b['acked'] for b in batches)
+        queued = sum(b['queued'] for b in batches)
+        self.stats['published'] += acked
+        # 断线期间写入发件箱的消息，重新连接后补发
+        self.stats['queued'] += queued
+        self.stats['failed'] += len(batch) - acked - queued
+
+    def _emit_progress(self):
+        # 只发给回放所属的会话，别的会话收到结束事件会重置自己的回放按钮
+        room = getattr(self.client, 'room', None)
+        if room:
+            socketio.emit('replay_progress', self.status(), to=room)
+
+
+_engines_lock = threading.Lock()
+
+
+def replay_engine_for(client):
+    """发布端客户端的回放引擎，保存在客户端上，随客户端被连接池回收而释放"""
+    with _engines_lock:
+        engine = getattr(client, 'replay_engine', None)
+        if engine is None:
+            engine = client.replay_engine = ReplayEngine(client)
+        return engine
@@ -1,45 +1,122 @@
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, g, Response, session
 from app import app, socketio
-from app.mqtt_client import publisher_client, subscriber_client
-from app.prediction import WeatherPredictor
+from flask_socketio import join_room
+from app.metrics import metrics
+from app.client_pool import client_pool
+from app.emitter import session_room, topic_rooms
+from app.jobs import training_jobs
+from app.profiles import PublishProfiles, parse_count, parse_qos, parse_retain
+from app.replay import replay_engine_for, resolve_data_path
+from app.history import broker_key, topic_history
+from src.series_cache import series_cache
+from werkzeug.utils import secure_filename
 import json
+import os
+import tempfile
 import pandas as pd
 import numpy as np
+import time
+import uuid
 
-# 全局变量存储预测结果
-prediction_results = {
-    'timestamps': None,
-    'actual_values': None,
-    'predicted_values': None,
-    'topic': None  # 添加主题字段
-}
+request_seconds = metrics.histogram('http_request_duration_seconds', 'HTTP请求处理耗时',
+                                    ['endpoint', 'method', 'status'])
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # 按路由（而不是具体URL）统计，避免任务ID等参数造成标签爆炸
+        request_seconds.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def session_id():
+    """浏览器会话的ID，用于在连接池中区分不同用户的客户端"""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+# 页面请求时就分配会话ID，Socket.IO连接建立时才能据此加入会话房间
 @app.route('/')
 def index():
+    session_id()
     return render_template('base.html')
 
 @app.route('/publisher')
 def publisher():
+    session_id()
     return render_template('publisher.html')
 
 @app.route('/subscriber')
 def subscriber():
+    session_id()
     return render_template('subscriber.html')
 
+def session_socket(sid):
+    """请求中的Socket.IO sid属于当前会话时返回它，否则返回None（不能让页面把别人的连接加入房间）"""
+    if not isinstance(sid, str) or 'sid' not in session:
+        return None
+    participants = socketio.server.manager.get_participants('/', session_room(session['sid']))
+    return sid if any(participant == sid for participant, _ in participants) else None
+
+def current_client(client_type):
+    """当前会话最近连接的该类型客户端，未连接时返回None"""
+    broker = session.get('brokers', {}).get(client_type)
+    if broker is None:
+        return None
+    return client_pool.get(session_id(), client_type, broker[0], broker[1])
+
+def history_broker():
+    """查询历史数据的broker：请求参数broker（地址:端口），否则为当前会话订阅端（或发布端）连接的broker"""
+    if request.args.get('broker'):
+        return request.args['broker']
+    brokers = session.get('brokers', {})
+    broker = brokers.get('subscriber') or brokers.get('publisher')
+    return broker_key(*broker) if broker is not None else None
+
 @app.route('/api/connect', methods=['POST'])
 def connect():
     try:
         data = request.json
         broker = data.get('broker', 'localhost')
-        port = int(data.get('port', 1883))
-        client_type = data.get('client_type')
+        port = parse_count(data.get('port', 1883), 'port', minimum=1, maximum=65535)
+        client_type = 'publisher' if data.get('client_type') == 'publisher' else 'subscriber'
 
-        print(f"Connecting {client_type} to MQTT broker: {broker}:{port}")
+        # 可选的在途窗口/排队上限，以及按主题过滤器设置的发布配置，连接前先校验
+        max_inflight, max_queued = data.get('max_inflight'), data.get('max_queued')
+        profiles = data.get('profiles') or {}
+        if client_type == 'publisher':
+            if max_inflight is not None:
+                parse_count(max_inflight, 'max_inflight', minimum=1)
+            if max_queued is not None:
+                parse_count(max_queued, 'max_queued')
+            if not isinstance(profiles, dict):
+                raise ValueError('profiles必须是 主题过滤器->发布配置 的对象')
+            for topic_filter, profile in profiles.items():
+                PublishProfiles.check(topic_filter, profile)
 
-        mqtt_client = publisher_client if client_type == 'publisher' else subscriber_client
+        print(f"Connecting {client_type} to MQTT broker: {broker}:{port}")
 
-        success = mqtt_client.connect(broker, port)
-        return jsonify({'success': success})
+        mqtt_client = client_pool.connect(session_id(), client_type, broker, port)
+        session['brokers'] = dict(session.get('brokers', {}), **{client_type: [broker, port]})
+        if client_type == 'publisher':
+            mqtt_client.configure(max_inflight, max_queued)
+            for topic_filter, profile in profiles.items():
+                mqtt_client.profiles.set_profile(topic_filter, profile)
+        return jsonify({
+            'success': mqtt_client.connected,
+            'message': '' if mqtt_client.connected else '未能连接到MQTT服务器'
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -54,7 +131,12 @@ def subscribe():
         if not topic:
             return jsonify({'success': False, 'message': '主题不能为空'})
 
-        success = subscriber_client.subscribe(topic)
+        subscriber_client = current_client('subscriber')
+        success = subscriber_client is not None and subscriber_client.subscribe(topic)
+        # 浏览器的Socket.IO连接加入该主题的房间，只接收匹配的数据
+        sid = session_socket(data.get('sid'))
+        if success and sid:
+            topic_rooms.join(sid, topic)
         return jsonify({
             'success': success,
             'message': '订阅成功' if success else '订阅失败'
@@ -73,7 +155,11 @@ def unsubscribe():
         if not topic:
             return jsonify({'success': False, 'message': '主题不能为空'})
 
-        success = subscriber_client.unsubscribe(topic)
+        subscriber_client = current_client('subscriber')
+        success = subscriber_client is not None and subscriber_client.unsubscribe(topic)
+        sid = session_socket(data.get('sid'))
+        if sid:
+            topic_rooms.leave(sid, topic)
         return jsonify({
             'success': success,
             'message': '取消订阅成功' if success else '取消订阅失败'
@@ -84,69 +170,268 @@ def unsubscribe():
             'message': f'取消订阅错误: {str(e)}'
         }), 500
 
-@app.route('/api/publish', methods=['POST'])
-def publish():
-    data = request.json
-    topic = data.get('topic', 'sensor/data')
-    message = {
+def build_message(data):
+    """从请求数据构造要发布的消息"""
+    return {
         'temperature': data.get('temperature'),
         'humidity': data.get('humidity'),
         'time': data.get('time')
     }
-    success = publisher_client.publish(topic, message)
+
+@app.route('/api/publish', methods=['POST'])
+def publish():
+    data = request.json
+    topic = data.get('topic', 'sensor/data')
+    message = build_message(data)
+    publisher_client = current_client('publisher')
+    if publisher_client is None:
+        return jsonify({'success': False})
+    try:
+        # profile设置该主题之后的发布配置；qos/retain只覆盖本条消息
+        qos = data.get('qos')
+        if qos is not None:
+            parse_qos(qos)
+        retain = parse_retain(data.get('retain'))
+        if data.get('profile'):
+            publisher_client.profiles.set_profile(topic, data['profile'])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    success = publisher_client.publish(topic, message, retain=retain, qos=qos)
     return jsonify({'success': success})
 
+@app.route('/api/publish_batch', methods=['POST'])
+def publish_batch():
+    try:
+        data = request.json
+        topic = data.get('topic', 'sensor/data')
+        readings = data.get('readings')
+        if not isinstance(readings, list) or not readings:
+            return jsonify({'success': False, 'message': '数据不能为空'})
+
+        # 与单条发布相同：qos/retain只覆盖本次发布，未指定时按主题的发布配置
+        qos = data.get('qos')
+        if qos is not None:
+            parse_qos(qos)
+        retain = parse_retain(data.get('retain'))
+
+        messages = [build_message(reading) for reading in readings]
+        publisher_client = current_client('publisher')
+        batches = publisher_client.publish_batch(topic, messages, retain=retain, qos=qos) \
+            if publisher_client is not None else None
+        if batches is None:
+            return jsonify({'success': False, 'message': '未连接到MQTT服务器'})
+
+        acked = sum(batch['acked'] for batch in batches)
+        queued = sum(batch['queued'] for batch in batches)
+        return jsonify({
+            'success': acked + queued == len(messages),
+            'published': acked,
+            'queued': queued,
+            'total': len(messages),
+            'batches': batches
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'批量发布错误: {str(e)}'
+        }), 500
+
+@app.route('/api/codec', methods=['POST'])
+def set_codec():
+    """设置发布端某个主题（可用通配符）的载荷编码：json或packed"""
+    data = request.json
+    topic = data.get('topic')
+    if not topic:
+        return jsonify({'success': False, 'message': '主题不能为空'})
+    publisher_client = current_client('publisher')
+    if publisher_client is None:
+        return jsonify({'success': False, 'message': '未连接到MQTT服务器'})
+    try:
+        publisher_client.codecs.set_codec(topic, data.get('codec', 'json'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return jsonify({'success': True})
+
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), 'mqtt_uploads')
+
+def current_replay_engine():
+    publisher_client = current_client('publisher')
+    return replay_engine_for(publisher_client) if publisher_client is not None else None
+
+@app.route('/api/replay/start', methods=['POST'])
+def replay_start():
+    try:
+        replay_engine = current_replay_engine()
+        if replay_engine is None:
+            return jsonify({'success': False, 'message': '未连接到MQTT服务器'})
+        if replay_engine.is_active():
+            return jsonify({'success': False, 'message': '回放正在进行中'})
+        params = request.form if 'file' in request.files else (request.json or {})
+        topic = params.get('topic') or 'sensor/data'
+        rate = float(params.get('rate') or 0)
+
+        # 支持上传文件（multipart）或指定data目录下的文件（JSON）
+        if 'file' in request.files:
+            upload = request.files['file']
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            # 每次上传一个独立的临时文件，回放结束后删除
+            fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix='-' + (secure_filename(upload.filename) or 'upload.txt'))
+            with os.fdopen(fd, 'wb') as f:
+                upload.save(f)
+            try:
+                replay_engine.start(path, topic, rate, remove_after=True)
+            except Exception:
+                os.remove(path)
+                raise
+        else:
+            if not params.get('path'):
+                return jsonify({'success': False, 'message': '请上传文件或指定data目录下的文件'})
+            replay_engine.start(resolve_data_path(params['path']), topic, rate)
+        return jsonify({'success': True, 'status': replay_engine.status()})
+    except (ValueError, RuntimeError) as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'回放错误: {str(e)}'
+        }), 500
+
+@app.route('/api/replay/<action>', methods=['POST'])
+def replay_control(action):
+    replay_engine = current_replay_engine()
+    if replay_engine is None:
+        return jsonify({'success': False, 'message': '未连接到MQTT服务器'})
+    if action == 'pause':
+        replay_engine.pause()
+    elif action == 'resume':
+        replay_engine.resume()
+    elif action == 'stop':
+        replay_engine.stop()
+    else:
+        return jsonify({'success': False, 'message': f'未知操作: {action}'}), 404
+    return jsonify({'success': True, 'status': replay_engine.status()})
+
+@app.route('/api/replay/status')
+def replay_status():
+    replay_engine = current_replay_engine()
+    return jsonify(replay_engine.status() if replay_engine is not None else {'state': 'idle'})
+
+@app.route('/api/history')
+def history():
+    try:
+        topic = request.args.get('topic')
+        if not topic:
+            return jsonify({'success': False, 'message': '主题不能为空'})
+        start = request.args.get('start')
+        end = request.args.get('end')
+        limit = request.args.get('limit', type=int)
+
+        broker = history_broker()
+        if broker is None:
+            return jsonify({'success': False, 'message': '未连接到MQTT服务器'})
+
+        # 支持MQTT通配符，返回每个匹配主题的数据
+        series = []
+        for matched_topic in topic_history.match_topics(broker, topic):
+            timestamps, values = topic_history.query(broker, matched_topic, start, end, limit)
+            series.append({
+                'topic': matched_topic,
+                'timestamps': np.datetime_as_string(timestamps, unit='s').tolist(),
+                'values': values.tolist()
+            })
+        return jsonify({'success': True, 'series': series})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'查询历史数据错误: {str(e)}'
+        }), 500
+
 @socketio.on('connect')
 def handle_connect():
+    # Socket.IO握手时带着页面的会话cookie，加入会话房间以接收本会话的连接状态等事件
+    if 'sid' in session:
+        join_room(session_room(session['sid']))
     print('Client connected')
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    topic_rooms.remove_sid(request.sid)
     print('Client disconnected')
 
+@socketio.on('join_topics')
+def handle_join_topics(topics):
+    """Socket.IO重新连接（sid变化）后重新加入已订阅主题的房间
+
+    只加入本会话订阅端确实订阅了的主题
+    """
+    if not isinstance(topics, list) or 'sid' not in session:
+        return
+    # Socket.IO中的session是握手时的副本，可能没有之后连接的broker，直接按会话ID查找
+    subscriber_client = client_pool.find(session['sid'], 'subscriber')
+    if subscriber_client is None:
+        return
+    for topic in topics:
+        if isinstance(topic, str) and topic in subscriber_client.subscribed_topics:
+            topic_rooms.join(request.sid, topic)
+
 @app.route('/prediction_results')
 def prediction_results():
     return render_template('prediction_results.html')
 
+def load_topic_series(topic, start=None, end=None, file=None):
+    """从服务器端读取主题数据：优先使用收到的历史数据，没有时使用data目录下的同名文件"""
+    if not file:
+        broker = history_broker()
+        if broker is not None:
+            timestamps, values = topic_history.query(broker, topic, start, end)
+            if len(values):
+                return pd.Series(values, index=pd.DatetimeIndex(timestamps))
+        file = topic.split('/')[-1] + '.txt'
+    series = series_cache.load_series(resolve_data_path(file))
+    return series.loc[start:end]
+
 @app.route('/api/predict', methods=['POST'])
 def predict():
-    global prediction_results
     try:
-        # 获取收集的数据和主题
-        data = request.json['data']
-        topic = request.json['topic']  # 获取主题
-
-        # 转换数据格式
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df.set_index('timestamp', inplace=True)
-
-        # 初始化预测器
-        predictor = WeatherPredictor()
-
-        # 训练模型并获取结果
-        results = predictor.train_lstm(df['value'])
-
-        # 存储结果（确保时间戳和数据对应）
-        prediction_results = {
-            'timestamps': results['test_timestamps'].astype('datetime64[s]').tolist(),
-            'actual_values': results['y_test'].flatten().tolist(),
-            'predicted_values': results['test_pred'].flatten().tolist(),
-            'topic': topic
-        }
-
-        # 按时间排序
-        sorted_indices = np.argsort(prediction_results['timestamps'])
-        prediction_results['timestamps'] = [prediction_results['timestamps'][i] for i in sorted_indices]
-        prediction_results['actual_values'] = [prediction_results['actual_values'][i] for i in sorted_indices]
-        prediction_results['predicted_values'] = [prediction_results['predicted_values'][i] for i in sorted_indices]
-
-        return jsonify({'success': True})
+        params = request.json
+        topic = params['topic']  # 获取主题
+
+        if 'data' in params:
+            # 浏览器上传的数据
+            df = pd.DataFrame(params['data'])
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            df.set_index('timestamp', inplace=True)
+            series = df['value']
+        else:
+            # 按主题和时间范围读取服务器端数据
+            series = load_topic_series(topic, params.get('start'), params.get('end'), params.get('file'))
+            if series.empty:
+                return jsonify({'success': False, 'error': '没有可用的数据'}), 404
+
+        # 提交训练任务，立即返回任务ID，训练进度通过Socket.IO推送
+        # mode为'update'时在已有模型上增量微调
+        mode = 'update' if params.get('mode') == 'update' else 'train'
+        job_id = training_jobs.submit(series, topic, mode=mode, session_id=session_id())
+        return jsonify({'success': True, 'job_id': job_id})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = training_jobs.get(job_id, session_id())
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(training_jobs.summary(job))
+
 @app.route('/api/prediction_results')
 def get_prediction_results():
-    if prediction_results is None:
+    job_id = request.args.get('job_id')
+    # 只返回当前会话提交的任务
+    job = training_jobs.get(job_id, session_id()) if job_id else training_jobs.latest_finished(session_id())
+    if job is None or job['result'] is None:
         return jsonify({'error': '没有可用的预测结果'}), 404
-    return jsonify(prediction_results)
\ No newline at end of file
+    return jsonify(job['result'])
@@ -18,6 +18,8 @@ let receivedData = {
     humidity: [],
     pressure: []
 };
+// 数据类型对应的完整MQTT主题，预测时按主题引用服务器端数据
+let collectedTopics = {};
 
 // 初始化图表
 function initCharts() {
@@ -153,29 +155,27 @@ async function connectBroker() {
         });
         
         const data = await response.json();
+        setConnectionState(data.success);
         if (data.success) {
-            console.log('MQTT连接请求已发送');
+            alert('已成功连接到MQTT服务器！');
         } else {
-            throw new Error('连接请求失败');
+            alert('MQTT连接失败：' + (data.message || '未知错误'));
         }
     } catch (error) {
         console.error('连接错误：', error);
         alert('连接错误：' + error.message);
-        connectBtn.disabled = false;
-        connectBtn.textContent = '连接';
+        setConnectionState(false);
     }
 }
 
-// 修改连接态监听
-const client_type = window.location.pathname.includes('publisher') ? 'publisher' : 'subscriber';
-socket.on(`mqtt_connected_${client_type}`, function(data) {
+// 根据连接状态更新按钮
+function setConnectionState(connected) {
     const connectBtn = document.getElementById('connectBtn');
     const startBtn = document.getElementById('startBtn');
     const subscribeBtn = document.getElementById('subscribeBtn');
     const unsubscribeBtn = document.getElementById('unsubscribeBtn');
 
-    if (data.status) {
-        alert('已成功连接到MQTT服务器！');
+    if (connected) {
         connectBtn.disabled = true;
         connectBtn.textContent = '已连接';
         if (startBtn) {
@@ -186,7 +186,6 @@ socket.on(`mqtt_connected_${client_type}`, function(data) {
             unsubscribeBtn.disabled = false;
         }
     } else {
-        alert('MQTT连接失败：' + (data.error || '未知错误'));
         connectBtn.disabled = false;
         connectBtn.textContent = '连接';
         if (startBtn) {
@@ -197,27 +196,59 @@ socket.on(`mqtt_connected_${client_type}`, function(data) {
             unsubscribeBtn.disabled = true;
         }
     }
+}
+
+// 服务器只把本会话客户端的连接状态（包括断线重连）推送给本会话的页面
+const client_type = window.location.pathname.includes('publisher') ? 'publisher' : 'subscriber';
+socket.on(`mqtt_connected_${client_type}`, function(data) {
+    setConnectionState(data.status);
 });
 
 // 发布者相关函数
-function startPublishing() {
+async function startPublishing() {
     const fileInput = document.getElementById('dataFile');
     const file = fileInput.files[0];
-    if (!file) {
+    const path = document.getElementById('dataPath').value.trim();
+    if (!file && !path) {
         alert('请选择数据文件！');
         return;
     }
 
-    publishing = true;
-    document.getElementById('startBtn').disabled = true;
-    document.getElementById('stopBtn').disabled = false;
-    
-    const reader = new FileReader();
-    reader.onload = function(e) {
-        const lines = e.target.result.split('\n');
-        publishData(lines);
-    };
-    reader.readAsText(file);
+    const topic = document.getElementById('topic').value || 'sensor/data';
+    const rate = document.getElementById('rate').value || 0;
+
+    // 由服务器读取文件并按速率回放，浏览器只负责控制和显示进度
+    let request;
+    if (file) {
+        const formData = new FormData();
+        formData.append('file', file);
+        formData.append('topic', topic);
+        formData.append('rate', rate);
+        request = { method: 'POST', body: formData };
+    } else {
+        request = {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ path, topic, rate })
+        };
+    }
+
+    try {
+        const response = await fetch('/api/replay/start', request);
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.message || '回放启动失败');
+        }
+        publishing = true;
+        document.getElementById('startBtn').disabled = true;
+        document.getElementById('pauseBtn').disabled = false;
+        document.getElementById('stopBtn').disabled = false;
+    } catch (error) {
+        console.error('发布错误：', error);
+        alert('发布数据时出错：' + error.message);
+    }
 }
 
 // 添加一个工具函数来转换主题名称为中文
@@ -235,106 +266,60 @@ function getTopicDisplayName(topic) {
     }
 }
 
-// 修改发布数据的日志显示
-async function publishData(lines) {
-    const topic = document.getElementById('topic').value || 'sensor/data';
-    const batchSize = 10; // 每批处理10条数据
-    let processedCount = 0;
-    
-    try {
-        // 解析所有数据
-        const allData = [];
-        for (let line of lines) {
-            try {
-                const dataObj = JSON.parse(line.trim());
-                for (const [timestamp, value] of Object.entries(dataObj)) {
-                    if (timestamp && !isNaN(parseFloat(value))) {
-                        allData.push({
-                            temperature: parseFloat(value),
-                            humidity: 0,
-                            time: timestamp,
-                            topic: topic
-                        });
-                    }
-                }
-            } catch (error) {
-                console.warn('跳过无效数据行:', line);
-                continue;
-            }
-        }
-
-        const log = document.getElementById('statusLog');
-        
-        // 批量处理数据
-        for (let i = 0; i < allData.length; i += batchSize) {
-            if (!publishing) break;
-            
-            const batch = allData.slice(i, i + batchSize);
-            const promises = batch.map(message => 
-                fetch('/api/publish', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify(message)
-                })
-            );
-
-            await Promise.all(promises);
-            processedCount += batch.length;
+// 暂停/继续回放
+async function togglePause() {
+    const pauseBtn = document.getElementById('pauseBtn');
+    const action = pauseBtn.textContent === '暂停' ? 'pause' : 'resume';
+    await fetch(`/api/replay/${action}`, { method: 'POST' });
+    pauseBtn.textContent = action === 'pause' ? '继续' : '暂停';
+}
 
-            // 更新状态日志
-            log.innerHTML += `<div class="log-entry">已发布${processedCount}/${allData.length}条数据</div>`;
-            log.scrollTop = log.scrollHeight;
+async function stopPublishing() {
+    await fetch('/api/replay/stop', { method: 'POST' });
+}
 
-            // 控制发送速率
-            await new Promise(resolve => setTimeout(resolve, 500));
-        }
-        
-        if (publishing) {
+// 回放进度
+socket.on('replay_progress', function(status) {
+    const log = document.getElementById('statusLog');
+    if (!log) {
+        return;
+    }
+    const percent = status.total_bytes ? (100 * status.bytes_read / status.total_bytes).toFixed(1) : '100.0';
+    const speed = status.elapsed > 0 ? (status.published / status.elapsed).toFixed(0) : 0;
+    log.innerHTML += `<div class="log-entry">[${status.state}] 已发布${status.published}条数据（${percent}%，${speed}条/秒，失败${status.failed}条）</div>`;
+    log.scrollTop = log.scrollHeight;
+
+    if (status.state === 'finished' || status.state === 'stopped' || status.state === 'error') {
+        publishing = false;
+        if (status.state === 'finished') {
             log.innerHTML += `<div class="log-entry">所有数据发布完成！</div>`;
+        } else if (status.error) {
+            log.innerHTML += `<div class="log-entry">发布出错：${status.error}</div>`;
         }
-    } catch (error) {
-        console.error('发布错误：', error);
-        alert('发布数据时出错：' + error.message);
+        document.getElementById('startBtn').disabled = false;
+        document.getElementById('pauseBtn').disabled = true;
+        document.getElementById('pauseBtn').textContent = '暂停';
+        document.getElementById('stopBtn').disabled = true;
     }
-}
-
-function stopPublishing() {
-    publishing = false;
-    document.getElementById('startBtn').disabled = false;
-    document.getElementById('stopBtn').disabled = true;
-}
+});
 
 // 订阅者相关函数
-socket.on('new_data', function(data) {
-    console.log('收到新数据:', data);
+const maxLogEntries = 500;
 
-    // 检查消息主题是否在已订阅列表中
-    const topicList = document.querySelector('.subscribed-topics');
-    const topicItems = Array.from(topicList.getElementsByClassName('topic-item'));
-    const isSubscribed = topicItems.some(item => item.textContent === data.topic);
+// 已订阅的主题（服务器只推送这些主题的数据）
+const subscribedTopics = new Set();
 
-    if (!isSubscribed) {
-        console.log('主题未订阅，忽略消息');
-        return;
-    }
-
-    // 更新数据日志
-    const log = document.getElementById('dataLog');
-    if (log) {
-        const time = new Date(data.time);
-        const entry = document.createElement('div');
-        entry.className = 'log-entry';
-        entry.textContent = `${time.toLocaleTimeString()} - [${data.topic}] 数值: ${data.temperature}`;
-        log.appendChild(entry);
-        log.scrollTop = log.scrollHeight;
+// Socket.IO重新连接后sid会变化，重新加入已订阅主题的房间
+socket.on('connect', function() {
+    if (subscribedTopics.size) {
+        socket.emit('join_topics', Array.from(subscribedTopics));
     }
+});
 
-    // 存储数据
+// 按主题分类存储一条数据
+function storeReading(data) {
     const topicName = data.topic.split('/').pop().toLowerCase();
-    console.log('Topic name:', topicName); // 添加调试日志
-    
+
     // 确保数据被正确分类存储
     switch (topicName) {
         case 'temperature':
@@ -362,22 +347,51 @@ socket.on('new_data', function(data) {
                 value: data.temperature
             });
     }
-    
-    console.log('Received data length:', {
-        temperature: receivedData.temperature.length,
-        humidity: receivedData.humidity.length,
-        pressure: receivedData.pressure.length
-    });
 
     // 根据主题分类存储预测数据
     if (collectedData[topicName]) {
+        collectedTopics[topicName] = data.topic;
         collectedData[topicName].push({
             timestamp: data.time,
             value: data.temperature
         });
     }
+}
 
-    // 显示每个主题的数据量
+// 处理服务器合并推送的一批数据
+function handleDataBatch(batch) {
+    const log = document.getElementById('dataLog');
+    const fragment = document.createDocumentFragment();
+    batch.items.forEach(data => {
+        data.topic = batch.topic;
+        storeReading(data);
+
+        const entry = document.createElement('div');
+        entry.className = 'log-entry';
+        entry.textContent = `${new Date(data.time).toLocaleTimeString()} - [${data.topic}] 数值: ${data.temperature}`;
+        fragment.appendChild(entry);
+    });
+    if (batch.dropped) {
+        const entry = document.createElement('div');
+        entry.className = 'log-entry text-warning';
+        entry.textContent = `[${batch.topic}] 服务器过载，丢弃了${batch.dropped}条数据`;
+        fragment.appendChild(entry);
+    }
+
+    // 更新数据日志，只保留最近的日志条目
+    if (log) {
+        log.appendChild(fragment);
+        while (log.childElementCount > maxLogEntries) {
+            log.removeChild(log.firstChild);
+        }
+        log.scrollTop = log.scrollHeight;
+    }
+
+    updateDataCount();
+}
+
+// 显示每个主题的数据量
+function updateDataCount() {
     document.getElementById('dataCount').textContent = 
         `已收集数据：温度${collectedData.temperature.length}条, ` +
         `湿度${collectedData.humidity.length}条, ` +
@@ -386,6 +400,47 @@ socket.on('new_data', function(data) {
     // 当任主题收集到足够数据时启用预测按钮
     const hasEnoughData = Object.values(collectedData).some(data => data.length >= 50);
     document.getElementById('predictBtn').disabled = !hasEnoughData;
+}
+
+// 从服务器加载主题的历史数据（页面刷新后也能恢复）
+async function loadHistory(topic) {
+    try {
+        const response = await fetch(`/api/history?topic=${encodeURIComponent(topic)}&limit=5000`);
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.message);
+        }
+        data.series.forEach(series => {
+            series.timestamps.forEach((time, index) => {
+                storeReading({ topic: series.topic, time: time, temperature: series.values[index] });
+            });
+        });
+        updateDataCount();
+    } catch (error) {
+        console.error('加载历史数据错误：', error);
+    }
+}
+
+socket.on('new_data_batch', handleDataBatch);
+
+socket.on('new_data', function(data) {
+    handleDataBatch({ topic: data.topic, items: [data], dropped: 0 });
+});
+
+// 服务器端流式预测结果，只显示每批最新的一条
+socket.on('prediction', function(batch) {
+    const log = document.getElementById('dataLog');
+    const latest = batch.items[batch.items.length - 1];
+    if (!log || !latest) return;
+    const entry = document.createElement('div');
+    entry.className = 'log-entry text-info';
+    entry.textContent = `${new Date(latest.time).toLocaleTimeString()} - [${batch.topic}] 预测下一值: ` +
+        latest.predictions.map(value => value.toFixed(2)).join(', ');
+    log.appendChild(entry);
+    while (log.childElementCount > maxLogEntries) {
+        log.removeChild(log.firstChild);
+    }
+    log.scrollTop = log.scrollHeight;
 });
 
 // 添加订阅相关函数
@@ -402,12 +457,14 @@ async function subscribeTopic() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ topic })
+            body: JSON.stringify({ topic, sid: socket.id })
         });
 
         const data = await response.json();
         if (data.success) {
+            subscribedTopics.add(topic);
             updateTopicList(topic);
+            loadHistory(topic);
             alert('订阅成功！');
         } else {
             alert('订阅失败：' + data.message);
@@ -431,11 +488,12 @@ async function unsubscribeTopic() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ topic })
+            body: JSON.stringify({ topic, sid: socket.id })
         });
 
         const data = await response.json();
         if (data.success) {
+            subscribedTopics.delete(topic);
             removeFromTopicList(topic);
             alert('取消订阅成功！');
         } else {
@@ -510,44 +568,29 @@ document.getElementById('predictBtn')?.addEventListener('click', async function(
         const selectedTopic = topicSelect.value;
         dialog.remove();
         
-        // 显示加载提示
-        const loadingDiv = document.createElement('div');
-        loadingDiv.className = 'position-fixed top-50 start-50 translate-middle';
-        loadingDiv.style.zIndex = '1000';
-        loadingDiv.innerHTML = `
-            <div class="card p-4 shadow">
-                <div class="d-flex align-items-center">
-                    <div class="spinner-border text-primary me-3" role="status">
-                        <span class="visually-hidden">加载中...</span>
-                    </div>
-                    <div>正在处理数据并训练模型，请稍候...</div>
-                </div>
-            </div>
-        `;
-        document.body.appendChild(loadingDiv);
-
         try {
             const response = await fetch('/api/predict', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
+                // 只发送主题，由服务器读取已保存的数据
+                // 已有模型时只用新数据增量微调
                 body: JSON.stringify({ 
-                    data: collectedData[selectedTopic],
-                    topic: selectedTopic
+                    topic: collectedTopics[selectedTopic] || selectedTopic,
+                    mode: 'update'
                 })
             });
 
-            if (response.ok) {
-                // 在新标签页中打开预测结果
-                window.open('/prediction_results', '_blank');
+            const result = await response.json();
+            if (response.ok && result.success) {
+                // 训练在服务器后台进行，结果页面显示训练进度
+                window.open(`/prediction_results?job_id=${result.job_id}`, '_blank');
             } else {
-                throw new Error('预测请求失败');
+                throw new Error(result.error || '预测请求失败');
             }
         } catch (error) {
             alert('预测错误：' + error.message);
-        } finally {
-            document.body.removeChild(loadingDiv);
         }
     };
 
@@ -764,6 +807,7 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('subscribeBtn')?.addEventListener('click', subscribeTopic);
     document.getElementById('unsubscribeBtn')?.addEventListener('click', unsubscribeTopic);
     document.getElementById('startBtn')?.addEventListener('click', startPublishing);
+    document.getElementById('pauseBtn')?.addEventListener('click', togglePause);
     document.getElementById('stopBtn')?.addEventListener('click', stopPublishing);
     document.getElementById('drawChartBtn')?.addEventListener('click', drawCharts);
 }); 
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""预测模型基准测试：WeatherPredictor.train_lstm / predict_future 和 WeatherARIMA
+
+用法：
+    python -m benchmarks.model_bench --scales 1 10 --seq-lengths 24 48 --batch-sizes 16 64
+    python -m benchmarks.model_bench --compare benchmarks/results/model-<旧提交>.json
+
+数据为data/目录下的序列（按小时重采样）和按1x/10x/100x长度生成的合成序列。
+每个场景在独立的子进程中运行，峰值RSS互不影响。
+"""
+import argparse
+import glob
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import compare, load_report, save_report
+
+# 比较时各指标的方向：True表示越大越好
+METRIC_DIRECTIONS = {
+    'epoch_time_s': False,
+    'train_time_s': False,
+    'forecast_step_ms': False,
+    'peak_rss_mb': False,
+    'RMSE': False,
+    'MAE': False
+}
+KEY_FIELDS = ['model', 'series', 'seq_length', 'batch_size']
+
+
+def make_series(name, scale):
+    """场景使用的序列：data/<name>.txt的小时序列，或按temperature长度的scale倍生成的合成序列（日周期+趋势+噪声）"""
+    from src.series_cache import series_cache
+    if not name.startswith('synthetic'):
+        return series_cache.load_resampled(os.path.join(ROOT, 'data', f'{name}.txt'))
+    base = series_cache.load_resampled(os.path.join(ROOT, 'data', 'temperature.txt'))
+    length = len(base) * scale
+    rng = np.random.default_rng(0)
+    hours = np.arange(length)
+    values = 10 + 8 * np.sin(2 * np.pi * hours / 24) + 0.001 * hours + rng.normal(0, 1, length)
+    return pd.Series(values, index=pd.date_range(start=base.index[0], periods=length, freq='H'))
+
+
+def peak_rss_mb():
+    # Linux上ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_lstm(series_name, scale, seq_length, batch_size, epochs, forecast_steps, repeats):
+    import tensorflow as tf
+    from app.prediction import WeatherPredictor
+
+    class EpochTimer(tf.keras.callbacks.Callback):
+        def on_train_begin(self, logs=None):
+            self.times = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.times.append(time.perf_counter() - self.started)
+
+    series = make_series(series_name, scale)
+    rss_before = peak_rss_mb()
+    predictor = WeatherPredictor(registry=None)
+    timer = EpochTimer()
+    started = time.perf_counter()
+    results = predictor.train_lstm(series, seq_length=seq_length, epochs=epochs, batch_size=batch_size,
+                                   callbacks=[timer], verbose=0)
+    train_time = time.perf_counter() - started
+    metrics = predictor.evaluate_model(results['y_test'], results['test_pred'])
+
+    # 第一次调用包含图编译，单独计时
+    started = time.perf_counter()
+    predictor.predict_future(series.values, steps=forecast_steps)
+    first_forecast = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(repeats):
+        predictor.predict_future(series.values, steps=forecast_steps)
+    forecast_time = (time.perf_counter() - started) / repeats
+
+    return dict(metrics, **{
+        'samples': len(series),
+        'epochs': epochs,
+        'train_time_s': train_time,
+        'epoch_time_s': float(np.median(timer.times)),
+        'epoch_times_s': timer.times,
+        'forecast_first_call_s': first_forecast,
+        'forecast_step_ms': forecast_time / forecast_steps * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before
+    })
+
+
+def bench_arima(series_name, scale, forecast_steps, n_jobs):
+    from app.prediction import WeatherPredictor
+    from src.model import WeatherARIMA
+
+    series = make_series(series_name, scale)
+    split = int(len(series) * 0.8)
+    train, test = series.iloc[:split], series.iloc[split:split + forecast_steps]
+    rss_before = peak_rss_mb()
+    model = WeatherARIMA(n_jobs=n_jobs)
+    started = time.perf_counter()
+    order = model.find_best_parameters(train)
+    search_time = time.perf_counter() - started
+    started = time.perf_counter()
+    model.train(train, order=order)
+    fit_time = time.perf_counter() - started
+    started = time.perf_counter()
+    forecast = model.predict(len(test))
+    forecast_time = time.perf_counter() - started
+    metrics = WeatherPredictor(registry=None).evaluate_model(test.values, np.asarray(forecast))
+
+    return dict(metrics, **{
+        'samples': len(series),
+        'order': list(order),
+        'search_time_s': search_time,
+        'train_time_s': search_time + fit_time,
+        'fit_time_s': fit_time,
+        'forecast_step_ms': forecast_time / len(test) * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before
+    })
+
+
+def run_case(case, args):
+    """在子进程中运行一个场景"""
+    if case['model'] == 'lstm':
+        import tensorflow as tf
+        tf.get_logger().setLevel('ERROR')
+        if args.threads:
+            tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+            tf.config.threading.set_inter_op_parallelism_threads(args.threads)
+        result = bench_lstm(case['series'], case['scale'], case['seq_length'], case['batch_size'],
+                            args.epochs, args.forecast_steps, args.repeats)
+    else:
+        result = bench_arima(case['series'], case['scale'], args.forecast_steps, args.arima_jobs)
+    return dict(case, **result)
+
+
+def build_cases(args):
+    series_names = [os.path.splitext(os.path.basename(path))[0]
+                    for path in sorted(glob.glob(os.path.join(ROOT, 'data', '*.txt')))]
+    series_names = [name for name in series_names if name in args.data] if args.data is not None else series_names
+    sources = [(name, 1) for name in series_names] + [('synthetic', scale) for scale in args.scales]
+
+    cases = []
+    for name, scale in sources:
+        label = name if name != 'synthetic' else f'synthetic-{scale}x'
+        if 'lstm' in args.models:
+            for seq_length in args.seq_lengths:
+                for batch_size in args.batch_sizes:
+                    cases.append({'model': 'lstm', 'series': label, 'scale': scale,
+                                  'seq_length': seq_length, 'batch_size': batch_size})
+        if 'arima' in args.models and scale <= args.arima_max_scale:
+            cases.append({'model': 'arima', 'series': label, 'scale': scale,
+                          'seq_length': None, 'batch_size': None})
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='预测模型基准测试')
+    parser.add_argument('--models', nargs='+', choices=['lstm', 'arima'], default=['lstm', 'arima'])
+    parser.add_argument('--data', nargs='*', help='使用的data/下的序列名（默认全部，传空列表则不用）')
+    parser.add_argument('--scales', type=int, nargs='*', default=[1, 10, 100], help='合成序列相对真实数据的长度倍数')
+    parser.add_argument('--seq-lengths', type=int, nargs='+', default=[24, 48])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--forecast-steps', type=int, default=24)
+    parser.add_argument('--repeats', type=int, default=10, help='预测计时的重复次数')
+    parser.add_argument('--arima-max-scale', type=int, default=10, help='ARIMA只在不超过该倍数的序列上运行')
+    parser.add_argument('--arima-jobs', type=int, default=None, help='ARIMA参数搜索的进程数')
+    parser.add_argument('--threads', type=int, default=0, help='TensorFlow线程数，0表示默认')
+    parser.add_argument('--output', help='结果JSON路径，默认为benchmarks/results/model-<提交>.json')
+    parser.add_argument('--compare', help='与之前的结果JSON比较')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定退化的相对变化阈值')
+    args = parser.parse_args()
+
+    cases = build_cases(args)
+    results = []
+    for i, case in enumerate(cases):
+        print(f"[{i + 1}/{len(cases)}] {case['model']} {case['series']} "
+              f"seq_length={case['seq_length']} batch_size={case['batch_size']}")
+        # 每个场景使用新的进程，峰值内存只反映该场景
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_case, case, args).result()
+        results.append(result)
+        print(f"    训练 {result['train_time_s']:.2f}s"
+              + (f"（每轮 {result['epoch_time_s']:.2f}s）" if 'epoch_time_s' in result else '')
+              + f"，预测每步 {result['forecast_step_ms']:.2f}ms，峰值RSS {result['peak_rss_mb']:.0f}MB，"
+              f"RMSE {result['RMSE']:.3f}")
+
+    report = save_report('model', results, args.output, epochs=args.epochs, forecast_steps=args.forecast_steps)
+    if args.compare:
+        regressions = compare(load_report(args.compare), report, KEY_FIELDS, METRIC_DIRECTIONS, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""端到端管道基准测试：发布端客户端 -> MQTT broker -> 订阅端MQTTClient.on_message -> Socket.IO
+
+用法：
+    python -m benchmarks.pipeline_bench --rates 100 1000 --payload-sizes 64 1024 --qos 0 1
+    python -m benchmarks.pipeline_bench --compare benchmarks/results/pipeline-<旧提交>.json
+
+未指定--broker时启动本地broker（优先使用mosquitto，否则使用amqtt）。
+结果保存为JSON，--compare与之前的结果比较，指标变差超过阈值时返回非零退出码。
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from app import app, socketio
+from app.history import TopicHistory
+from app.client_pool import client_pool
+from benchmarks.report import compare, load_report, save_report
+
+# 比较时各指标的方向：True表示越大越好
+METRIC_DIRECTIONS = {
+    'latency_p50_ms': False,
+    'latency_p95_ms': False,
+    'latency_p99_ms': False,
+    'throughput': True,
+    'drop_rate': False,
+    'cpu_percent': False,
+    'peak_rss_mb': False
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class LocalBroker:
+    """在本地端口上启动的临时broker进程"""
+
+    def __init__(self, port=None):
+        self.port = port or free_port()
+        self.process = None
+        self.workdir = None
+        self.kind = None
+
+    def start(self):
+        self.workdir = tempfile.mkdtemp(prefix='mqtt_bench_')
+        if shutil.which('mosquitto'):
+            config = os.path.join(self.workdir, 'mosquitto.conf')
+            with open(config, 'w') as f:
+                f.write(f'listener {self.port} 127.0.0.1\nallow_anonymous true\nmax_queued_messages 0\n')
+            command = ['mosquitto', '-c', config]
+            self.kind = 'mosquitto'
+        elif shutil.which('amqtt'):
+            config = os.path.join(self.workdir, 'amqtt.yaml')
+            with open(config, 'w') as f:
+                f.write(f'listeners:\n  default:\n    type: tcp\n    bind: 127.0.0.1:{self.port}\n'
+                        'plugins:\n  amqtt.plugins.authentication.AnonymousAuthPlugin:\n'
+                        '    allow_anonymous: true\n')
+            command = ['amqtt', '-c', config]
+            self.kind = 'amqtt'
+        else:
+            raise RuntimeError('未找到mosquitto或amqtt，请用--broker指定已有的broker')
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not wait_for_port(self.port):
+            self.stop()
+            raise RuntimeError(f'{self.kind}启动失败')
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+
+class ResourceSampler:
+    """统计本进程（及broker进程）的CPU时间和内存"""
+
+    def __init__(self, broker_pid=None):
+        self.processes = []
+        if psutil is not None:
+            self.processes.append(psutil.Process())
+            if broker_pid is not None:
+                self.processes.append(psutil.Process(broker_pid))
+
+    def cpu_times(self):
+        if self.processes:
+            return [sum(p.cpu_times()[:2]) for p in self.processes]
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return [usage.ru_utime + usage.ru_stime]
+
+    def rss_mb(self):
+        if self.processes:
+            return [p.memory_info().rss / 1024 ** 2 for p in self.processes]
+        # 没有psutil时只能取本进程的峰值（Linux上单位为KB）
+        return [resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024]
+
+
+def make_payload(run_id, seq, payload_size):
+    message = {'run': run_id, 'seq': seq, 'sent_at': time.time(), 'temperature': 20.0, 'time': ''}
+    padding = payload_size - len(json.dumps(message))
+    if padding > 0:
+        message['pad'] = 'x' * padding
+    return message
+
+
+def run_scenario(client, publisher_client, subscriber_client, rate, payload_size, qos, duration, drain_timeout,
+                 sampler, poll_interval=0.002):
+    """按目标速率发布duration秒，通过Socket.IO测试客户端接收并统计"""
+    run_id = f'{rate}-{payload_size}-{qos}-{time.time_ns()}'
+    topic = f'bench/{run_id}'
+    subscriber_client.subscribe(topic, qos=qos)
+    # 测试客户端加入该主题的房间
+    client.emit('join_topics', [topic])
+    time.sleep(0.2)
+    client.get_received()
+
+    latencies = []
+    received = set()
+    dropped_by_server = 0
+    peak_rss = [0.0] * len(sampler.rss_mb())
+
+    def drain():
+        nonlocal dropped_by_server
+        now = time.time()
+        for packet in client.get_received():
+            if packet['name'] == 'new_data_batch':
+                batch = packet['args'][0]
+                items = batch['items']
+                dropped_by_server += batch.get('dropped', 0)
+            elif packet['name'] == 'new_data':
+                items = [packet['args'][0]]
+            else:
+                continue
+            for item in items:
+                if item.get('run') == run_id and item['seq'] not in received:
+                    received.add(item['seq'])
+                    latencies.append(now - item['sent_at'])
+
+    cpu_before = sampler.cpu_times()
+    start = time.time()
+    sent = failed = 0
+    while time.time() - start < duration:
+        # 按计划时间发送，落后时连续发送追赶
+        due = start + sent / rate if rate > 0 else 0
+        now = time.time()
+        if due > now:
+            drain()
+            time.sleep(min(poll_interval, due - now))
+            continue
+        if publisher_client.publish(topic, make_payload(run_id, sent, payload_size), retain=False, qos=qos):
+            sent += 1
+        else:
+            failed += 1
+            sent += 1
+        if sent % 100 == 0:
+            drain()
+            peak_rss = [max(a, b) for a, b in zip(peak_rss, sampler.rss_mb())]
+    publish_end = time.time()
+
+    deadline = time.time() + drain_timeout
+    while len(received) < sent - failed and time.time() < deadline:
+        drain()
+        time.sleep(poll_interval)
+    drain()
+    elapsed = time.time() - start
+    cpu_after = sampler.cpu_times()
+    peak_rss = [max(a, b) for a, b in zip(peak_rss, sampler.rss_mb())]
+    subscriber_client.unsubscribe(topic)
+
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.array([np.nan])
+    cpu_percent = [(after - before) / elapsed * 100 for before, after in zip(cpu_before, cpu_after)]
+    return {
+        'rate': rate,
+        'payload_size': payload_size,
+        'qos': qos,
+        'duration': duration,
+        'sent': sent,
+        'publish_failed': failed,
+        'received': len(received),
+        'dropped': sent - len(received),
+        'dropped_by_server': dropped_by_server,
+        'drop_rate': (sent - len(received)) / sent if sent else 0.0,
+        'publish_rate': sent / (publish_end - start),
+        'throughput': len(received) / elapsed,
+        'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+        'latency_p99_ms': float(np.percentile(latencies_ms, 99)),
+        'latency_max_ms': float(np.max(latencies_ms)),
+        'cpu_percent': cpu_percent[0],
+        'broker_cpu_percent': cpu_percent[1] if len(cpu_percent) > 1 else None,
+        'peak_rss_mb': peak_rss[0],
+        'broker_peak_rss_mb': peak_rss[1] if len(peak_rss) > 1 else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MQTT -> Socket.IO 端到端基准测试')
+    parser.add_argument('--broker', help='已有broker地址host:port，不指定时启动本地broker')
+    parser.add_argument('--rates', type=float, nargs='+', default=[100, 500, 1000], help='每秒发布消息数，0表示尽可能快')
+    parser.add_argument('--payload-sizes', type=int, nargs='+', default=[64, 1024])
+    parser.add_argument('--qos', type=int, nargs='+', choices=[0, 1], default=[0, 1])
+    parser.add_argument('--duration', type=float, default=5.0, help='每个场景的发布时长（秒）')
+    parser.add_argument('--drain-timeout', type=float, default=5.0, help='发布结束后等待接收的时间（秒）')
+    parser.add_argument('--output', help='结果JSON路径，默认为benchmarks/results/pipeline-<提交>.json')
+    parser.add_argument('--compare', help='与之前的结果JSON比较')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定退化的相对变化阈值')
+    args = parser.parse_args()
+
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        port = int(port or 1883)
+    else:
+        broker = LocalBroker().start()
+        host, port = '127.0.0.1', broker.port
+        print(f"已启动本地{broker.kind}: {host}:{port}")
+
+    history_dir = tempfile.mkdtemp(prefix='mqtt_bench_history_')
+    # 历史数据写入临时库，不影响instance目录
+    client_pool.history = TopicHistory(db_path=os.path.join(history_dir, 'history.sqlite3'))
+    # 先请求页面取得会话ID，Socket.IO测试客户端带上同一个Flask会话，
+    # 否则join_topics找不到会话的订阅端，不会加入主题房间
+    flask_client = app.test_client()
+    flask_client.get('/subscriber')
+    with flask_client.session_transaction() as flask_session:
+        session_id = flask_session['sid']
+    client = socketio.test_client(app, flask_test_client=flask_client)
+    try:
+        publisher_client = client_pool.connect(session_id, 'publisher', host, port)
+        subscriber_client = client_pool.connect(session_id, 'subscriber', host, port)
+        if not (publisher_client.connected and subscriber_client.connected):
+            raise RuntimeError(f'无法连接到broker {host}:{port}')
+        sampler = ResourceSampler(broker.process.pid if broker is not None else None)
+        scenarios = []
+        for qos in args.qos:
+            for payload_size in args.payload_sizes:
+                for rate in args.rates:
+                    result = run_scenario(client, publisher_client, subscriber_client, rate, payload_size, qos,
+                                          args.duration, args.drain_timeout, sampler)
+                    if result['sent'] and not result['received']:
+                        # 一条都没收到说明管道没有连通（例如没有加入主题房间），结果没有意义
+                        raise RuntimeError(f"qos={qos} payload={payload_size}B rate={rate:g}: "
+                                           f"发送{result['sent']}条但一条都没有收到")
+                    scenarios.append(result)
+                    print(f"qos={qos} payload={payload_size}B rate={rate:g}: "
+                          f"{result['throughput']:.0f} msg/s, p50={result['latency_p50_ms']:.1f}ms "
+                          f"p95={result['latency_p95_ms']:.1f}ms p99={result['latency_p99_ms']:.1f}ms, "
+                          f"丢失{result['dropped']}条, CPU {result['cpu_percent']:.0f}%")
+    finally:
+        client.disconnect()
+        client_pool.release(session_id, 'publisher')
+        client_pool.release(session_id, 'subscriber')
+        if broker is not None:
+            broker.stop()
+        shutil.rmtree(history_dir, ignore_errors=True)
+
+    report = save_report('pipeline', scenarios, args.output,
+                         broker=broker.kind if broker is not None else args.broker)
+    if args.compare:
+        regressions = compare(load_report(args.compare), report, ['rate', 'payload_size', 'qos'],
+                              METRIC_DIRECTIONS, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""基准测试结果的保存和对比"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_report(name, entries, output=None, **info):
+    """保存结果JSON，默认路径为benchmarks/results/<name>-<提交>.json，返回报告"""
+    report = {
+        'benchmark': name,
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+    report.update(info)
+    report['scenarios'] = entries
+    output = output or os.path.join(RESULTS_DIR, f"{name}-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+    return report
+
+
+def load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline, current, key_fields, directions, threshold):
+    """打印两次结果的对比，返回变差超过阈值的(场景, 指标, 旧值, 新值)列表
+
+    key_fields: 用于匹配两次结果中同一场景的字段
+    directions: 指标 -> 是否越大越好
+    """
+    def key(scenario):
+        return tuple(scenario.get(field) for field in key_fields)
+
+    baseline_scenarios = {key(s): s for s in baseline['scenarios']}
+    regressions = []
+    print(f"对比 {baseline.get('commit')} -> {current.get('commit')}（阈值 {threshold:.0%}）")
+    for scenario in current['scenarios']:
+        old = baseline_scenarios.get(key(scenario))
+        if old is None:
+            continue
+        print(' '.join(f'{field}={scenario.get(field)}' for field in key_fields))
+        for metric, higher_is_better in directions.items():
+            before, after = old.get(metric), scenario.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / abs(before) if before else 0.0
+            worse = change < -threshold if higher_is_better else change > threshold
+            # 从0变为非0（例如丢包率）也视为退化
+            if not higher_is_better and before == 0 and after > 0:
+                worse = True
+            print(f"  {metric:20s} {before:12.3f} -> {after:12.3f} ({change:+.1%}){'  退化' if worse else ''}")
+            if worse:
+                regressions.append((key(scenario), metric, before, after))
+    return regressions
@@ -1,20 +1,137 @@
 import paho.mqtt.client as mqtt
+import argparse
+import heapq
 import time
 import json
+import queue
 import tkinter as tk
 from tkinter import ttk, filedialog
-import pandas as pd
 from tkinter import messagebox
 import threading
+from collections import deque
+from itertools import islice
+import numpy as np
+from src.data_processor import parse_lines
+
+
+def iter_messages(path, chunk_lines=64, reorder_window=10000):
+    """分块读取JSON行格式的数据文件，按时间顺序生成(时间戳, 消息)
+
+    文件中的读数只是局部乱序，用大小为reorder_window的堆重新排序，内存占用与文件大小无关。
+    """
+    heap = []
+    with open(path, 'rb') as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            timestamps, values = parse_lines(lines, sort=False)
+            for timestamp, value in zip(timestamps.astype(np.int64).tolist(), values.tolist()):
+                heapq.heappush(heap, (timestamp, value))
+            while len(heap) > reorder_window:
+                yield _to_message(*heapq.heappop(heap))
+    while heap:
+        yield _to_message(*heapq.heappop(heap))
+
+
+def _to_message(timestamp, value):
+    return timestamp, {
+        "temperature": value,
+        "humidity": 0,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp))
+    }
+
+
+class TokenBucket:
+    """令牌桶限速：平均每秒rate个令牌，最多积累burst个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate / 10)
+        self.tokens = self.capacity
+        self.last = time.perf_counter()
+
+    def acquire(self, count=1):
+        while True:
+            now = time.perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return
+            time.sleep((count - self.tokens) / self.rate)
+
+
+class FileReplayer:
+    """把数据文件按时间顺序回放到MQTT
+
+    rate为每秒消息数（令牌桶限速），speedup为时间压缩倍数（按读数时间间隔/speedup发送），
+    两者都为0时尽可能快。log为接收状态文本的回调，不在UI线程中调用。
+    """
+
+    def __init__(self, publisher, path, topic="sensor/data", rate=0, speedup=0, loop=False, log=None,
+                 log_every=100):
+        self.publisher = publisher
+        self.path = path
+        self.topic = topic
+        self.rate = rate
+        self.speedup = speedup
+        self.loop = loop
+        self.log = log or print
+        self.log_every = log_every
+        self.running = threading.Event()
+
+    def run(self):
+        self.running.set()
+        bucket = TokenBucket(self.rate) if self.rate > 0 else None
+        sent = 0
+        try:
+            while self.running.is_set():
+                start_time = time.perf_counter()
+                first_timestamp = None
+                for timestamp, message in iter_messages(self.path):
+                    if not self.running.is_set():
+                        break
+                    if self.speedup > 0:
+                        # 按读数之间的时间间隔压缩后发送
+                        if first_timestamp is None:
+                            first_timestamp = timestamp
+                        delay = start_time + (timestamp - first_timestamp) / self.speedup - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    if bucket is not None:
+                        bucket.acquire()
+                    self.publisher.publish_message(message, self.topic)
+                    sent += 1
+                    if sent % self.log_every == 0:
+                        self.log(f"已发布{sent}条，最新: {message}")
+                if not self.loop:
+                    break
+            self.publisher.wait_for_inflight()
+            self.log(f"回放结束，共发布{sent}条")
+        except Exception as e:
+            self.log(f"发布数据时出错: {str(e)}")
+        finally:
+            self.running.clear()
+
+    def stop(self):
+        self.running.clear()
+
 
 class PublisherGUI:
-    def __init__(self):
+    def __init__(self, max_log_lines=500, refresh_interval=200):
         self.root = tk.Tk()
         self.root.title("MQTT数据发布器")
         self.root.geometry("800x600")
         
         self.publisher = SimplePublisher()
+        self.replayer = None
+        self.max_log_lines = max_log_lines
+        self.refresh_interval = refresh_interval
+        # 工作线程只往这里放日志，由Tk主循环定时批量写入文本框
+        self.log_queue = queue.Queue()
         self.setup_gui()
+        self.root.after(self.refresh_interval, self.refresh_status)
         
     def setup_gui(self):
         # 连接设置框架
@@ -43,6 +160,38 @@ class PublisherGUI:
         
         ttk.Button(file_frame, text="选择文件", command=self.select_file).grid(row=0, column=1)
         
+        # 回放设置
+        replay_frame = ttk.LabelFrame(self.root, text="回放设置", padding="5")
+        replay_frame.pack(fill="x", padx=5, pady=5)
+        
+        ttk.Label(replay_frame, text="主题:").grid(row=0, column=0)
+        self.topic_entry = ttk.Entry(replay_frame, width=20)
+        self.topic_entry.insert(0, "sensor/data")
+        self.topic_entry.grid(row=0, column=1)
+        
+        ttk.Label(replay_frame, text="速率(条/秒, 0不限):").grid(row=0, column=2)
+        self.rate_entry = ttk.Entry(replay_frame, width=8)
+        self.rate_entry.insert(0, "0")
+        self.rate_entry.grid(row=0, column=3)
+        
+        ttk.Label(replay_frame, text="时间压缩倍数(0不用):").grid(row=0, column=4)
+        self.speedup_entry = ttk.Entry(replay_frame, width=8)
+        self.speedup_entry.insert(0, "0")
+        self.speedup_entry.grid(row=0, column=5)
+        
+        ttk.Label(replay_frame, text="QoS:").grid(row=1, column=0)
+        self.qos_box = ttk.Combobox(replay_frame, values=["0", "1"], width=5, state="readonly")
+        self.qos_box.set("1")
+        self.qos_box.grid(row=1, column=1, sticky="w")
+        
+        ttk.Label(replay_frame, text="在途窗口:").grid(row=1, column=2)
+        self.window_entry = ttk.Entry(replay_frame, width=8)
+        self.window_entry.insert(0, "100")
+        self.window_entry.grid(row=1, column=3)
+        
+        self.loop_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(replay_frame, text="循环回放", variable=self.loop_var).grid(row=1, column=4)
+        
         # 发布控制
         control_frame = ttk.LabelFrame(self.root, text="发布控制", padding="5")
         control_frame.pack(fill="x", padx=5, pady=5)
@@ -53,6 +202,10 @@ class PublisherGUI:
         self.stop_btn = ttk.Button(control_frame, text="停止发布", command=self.stop_publishing, state="disabled")
         self.stop_btn.pack(side="left", padx=5)
         
+        # 实时速率和确认延迟
+        self.stats_label = ttk.Label(control_frame, text="")
+        self.stats_label.pack(side="left", padx=10)
+        
         # 状态显示
         self.status_text = tk.Text(self.root, height=20)
         self.status_text.pack(fill="both", expand=True, padx=5, pady=5)
@@ -80,7 +233,19 @@ class PublisherGUI:
         if not self.file_path.get():
             messagebox.showerror("错误", "请先选择数据文件")
             return
+        try:
+            rate = float(self.rate_entry.get() or 0)
+            speedup = float(self.speedup_entry.get() or 0)
+            window = int(self.window_entry.get() or 1)
+        except ValueError:
+            messagebox.showerror("错误", "速率、压缩倍数和在途窗口必须是数字")
+            return
             
+        self.publisher.configure(qos=int(self.qos_box.get()), window=window)
+        self.publisher.reset_stats()
+        self.replayer = FileReplayer(self.publisher, self.file_path.get(), topic=self.topic_entry.get(),
+                                     rate=rate, speedup=speedup, loop=self.loop_var.get(),
+                                     log=self.log_queue.put_nowait)
         self.publishing = True
         self.start_btn.config(state="disabled")
         self.stop_btn.config(state="normal")
@@ -90,44 +255,62 @@ class PublisherGUI:
     
     def stop_publishing(self):
         self.publishing = False
+        if self.replayer is not None:
+            self.replayer.stop()
         self.start_btn.config(state="normal")
         self.stop_btn.config(state="disabled")
     
     def publish_data(self):
-        try:
-            with open(self.file_path.get(), 'r') as file:
-                data_lines = file.readlines()
-                while self.publishing:
-                    for line in data_lines:
-                        if not self.publishing:
-                            break
-                        # 解析每行数据（格式：温度,湿度）
-                        try:
-                            temp, humid = map(float, line.strip().split(','))
-                            message = {
-                                "temperature": temp,
-                                "humidity": humid,
-                                "time": time.strftime("%Y-%m-%d %H:%M:%S")
-                            }
-                            self.publisher.publish_message(message)
-                            self.status_text.insert("end", f"已发布: {message}\n")
-                            self.status_text.see("end")
-                            time.sleep(2)
-                        except ValueError as e:
-                            self.status_text.insert("end", f"跳过无效数据行: {line}\n")
-                            continue
-        except Exception as e:
-            messagebox.showerror("错误", f"发布数据时出错: {str(e)}")
+        self.replayer.run()
+        self.publishing = False
+    
+    def refresh_status(self):
+        """Tk主循环中定时批量写入日志并刷新统计"""
+        lines = []
+        while True:
+            try:
+                lines.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.status_text.insert("end", "".join(f"{line}\n" for line in lines[-self.max_log_lines:]))
+            count = int(self.status_text.index("end-1c").split(".")[0])
+            if count > self.max_log_lines:
+                self.status_text.delete("1.0", f"{count - self.max_log_lines}.0")
+            self.status_text.see("end")
+        if not self.publishing and str(self.stop_btn["state"]) == "normal":
             self.stop_publishing()
+        stats = self.publisher.stats()
+        self.stats_label.config(text=f"已发布: {stats['published']}  速率: {stats['rate']:.0f}条/秒  "
+                                     f"确认延迟: 平均{stats['latency_avg']:.1f}ms / p95 {stats['latency_p95']:.1f}ms  "
+                                     f"在途: {stats['inflight']}")
+        self.root.after(self.refresh_interval, self.refresh_status)
     
     def run(self):
         self.root.mainloop()
 
 class SimplePublisher:
-    def __init__(self):
+    def __init__(self, qos=1, window=100):
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_publish = self.on_publish
+        self.condition = threading.Condition()
+        self.inflight = {}  # mid -> 发送时间
+        self.early_acks = {}  # 发送调用返回前就已确认的mid -> 确认时间
+        self.configure(qos, window)
+        self.reset_stats()
+
+    def configure(self, qos=1, window=100):
+        self.qos = qos
+        self.window = max(1, window)
+        self.client.max_inflight_messages_set(self.window)
+
+    def reset_stats(self):
+        with self.condition:
+            self.published = 0
+            self.acked = 0
+            self.latencies = deque(maxlen=1000)
+            self.rate_samples = deque([(time.perf_counter(), 0)], maxlen=20)
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -136,17 +319,93 @@ class SimplePublisher:
             raise Exception(f"Failed to connect, return code {rc}")
 
     def on_publish(self, client, userdata, mid):
-        print(f"Message Published. Message ID: {mid}")
+        # QoS 1收到PUBACK、QoS 0写入套接字后调用
+        now = time.perf_counter()
+        with self.condition:
+            sent_at = self.inflight.pop(mid, None)
+            if sent_at is None:
+                self.early_acks[mid] = now
+                return
+            self.acked += 1
+            self.latencies.append(now - sent_at)
+            self.condition.notify()
 
     def connect(self, host="localhost", port=1883):
         self.client.connect(host, port)
         self.client.loop_start()
 
-    def publish_message(self, message):
-        result = self.client.publish("sensor/data", json.dumps(message))
+    def publish_message(self, message, topic="sensor/data"):
+        # 在途消息达到窗口大小时等待确认
+        with self.condition:
+            while len(self.inflight) >= self.window:
+                self.condition.wait(1.0)
+        sent_at = time.perf_counter()
+        result = self.client.publish(topic, json.dumps(message), qos=self.qos)
         if result[0] != 0:
             raise Exception("Failed to send message")
+        # 调用publish时不能持有锁，否则可能与网络线程中的on_publish互相等待
+        with self.condition:
+            self.published += 1
+            acked_at = self.early_acks.pop(result.mid, None)
+            if acked_at is None:
+                self.inflight[result.mid] = sent_at
+            else:
+                self.acked += 1
+                self.latencies.append(acked_at - sent_at)
+
+    def wait_for_inflight(self, timeout=10):
+        """等待在途消息全部确认"""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.inflight and time.time() < deadline:
+                self.condition.wait(0.1)
+
+    def stats(self):
+        """发布数量、最近几秒的发送速率和确认延迟（毫秒）"""
+        now = time.perf_counter()
+        with self.condition:
+            if now - self.rate_samples[-1][0] >= 0.2:
+                self.rate_samples.append((now, self.published))
+            first_time, first_count = self.rate_samples[0]
+            latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+            return {
+                'published': self.published,
+                'acked': self.acked,
+                'inflight': len(self.inflight),
+                'rate': (self.published - first_count) / (now - first_time) if now > first_time else 0.0,
+                'latency_avg': float(latencies.mean()),
+                'latency_p95': float(np.percentile(latencies, 95))
+            }
 
 if __name__ == '__main__':
-    gui = PublisherGUI()
-    gui.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='MQTT数据发布器')
+    parser.add_argument('--file', help='不启动界面，直接回放该数据文件（用于压力测试）')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', default='sensor/data')
+    parser.add_argument('--rate', type=float, default=0, help='每秒消息数，0表示不限速')
+    parser.add_argument('--speedup', type=float, default=0, help='时间压缩倍数，0表示不按时间间隔发送')
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=1)
+    parser.add_argument('--window', type=int, default=100, help='在途消息窗口')
+    parser.add_argument('--loop', action='store_true', help='循环回放')
+    args = parser.parse_args()
+
+    if args.file:
+        publisher = SimplePublisher(qos=args.qos, window=args.window)
+        publisher.connect(args.host, args.port)
+        replayer = FileReplayer(publisher, args.file, topic=args.topic, rate=args.rate,
+                                speedup=args.speedup, loop=args.loop, log_every=10 ** 9)
+        thread = threading.Thread(target=replayer.run, daemon=True)
+        thread.start()
+        try:
+            while thread.is_alive():
+                thread.join(1.0)
+                stats = publisher.stats()
+                print(f"已发布: {stats['published']}  速率: {stats['rate']:.0f}条/秒  "
+                      f"确认延迟: 平均{stats['latency_avg']:.1f}ms / p95 {stats['latency_p95']:.1f}ms")
+        except KeyboardInterrupt:
+            replayer.stop()
+            thread.join()
+    else:
+        gui = PublisherGUI()
+        gui.run()
@@ -1,7 +1,65 @@
 import pandas as pd
 import numpy as np
 import json
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Tuple
+
+
+def to_datetime64(timestamps: list, unit: str = 's') -> np.ndarray:
+    """一次性转换所有时间戳，ISO格式走numpy的快速路径"""
+    try:
+        return np.array(timestamps, dtype=f'datetime64[{unit}]')
+    except ValueError:
+        return pd.to_datetime(timestamps).values.astype(f'datetime64[{unit}]')
+
+
+def parse_lines(lines: Iterable, sort: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """解析data/*.txt格式（每行一个 时间戳->数值 的JSON对象）为列式数组
+
+    返回(timestamps, values)：datetime64[s]数组和float64数组。
+    空值、无法解析的值和无效行会被跳过；sort为True时按时间排序，
+    重复时间戳保留最后出现的值。
+    """
+    keys = []
+    raw_values = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            # 数组、数字等不是 时间戳->数值 对象的行属于无效行
+            continue
+        keys.extend(record.keys())
+        raw_values.extend(record.values())
+
+    values = pd.to_numeric(pd.Series(raw_values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    timestamps = to_datetime64(keys) if keys else np.array([], dtype='datetime64[s]')
+    valid = ~np.isnan(values)
+    timestamps, values = timestamps[valid], values[valid]
+
+    if sort and len(timestamps):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+        # 稳定排序后相同时间戳保持原有顺序，保留每组最后一个
+        last = np.append(timestamps[1:] != timestamps[:-1], True)
+        timestamps, values = timestamps[last], values[last]
+    return timestamps, values
+
+
+def load_series_arrays(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """读取数据文件为按时间排序、去重后的(timestamps, values)数组"""
+    with open(file_path, 'rb') as f:
+        return parse_lines(f)
+
+
+def load_series(file_path: str) -> pd.Series:
+    """读取数据文件为以时间为索引的pd.Series"""
+    timestamps, values = load_series_arrays(file_path)
+    return pd.Series(values, index=pd.DatetimeIndex(timestamps), name='value')
+
 
 class WeatherDataProcessor:
     def __init__(self):
@@ -9,24 +67,9 @@ class WeatherDataProcessor:
         
     def load_data(self, file_path: str) -> pd.Series:
         """加载并处理数据文件"""
-        data_dict = {}
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    # 解析每行的JSON数据
-                    try:
-                        d = eval(line.strip())
-                        data_dict.update(d)
-                    except:
-                        continue
-        
-        # 转换为时间序列数据
-        series = pd.Series(data_dict)
-        series.index = pd.to_datetime(series.index)
-        series = series.sort_index()
-        
-        # 转换数据类型为float
-        series = series.astype(float)
+        # 延迟导入：series_cache依赖本模块的解析函数
+        from src.series_cache import series_cache
+        series = series_cache.load_series(file_path)
         
         # 处理缺失值
         series = series.interpolate()
@@ -0,0 +1,44 @@
+import numpy as np
+import tensorflow as tf
+
+# 编译好的滚动预测函数保存在模型的这个属性上：函数闭包引用着模型，
+# 放在以模型为键的全局缓存里会让模型永远无法释放；放在模型上则随模型一起回收
+_ROLLOUT_ATTR = '_rollout_function'
+
+
+def _compiled_rollout(model, seq_length):
+    """每个模型（和序列长度）编译一次的滚动预测函数"""
+    cached = model.__dict__.get(_ROLLOUT_ATTR)
+    if cached is not None and cached[0] == seq_length:
+        return cached[1]
+
+    @tf.function(input_signature=[
+        tf.TensorSpec(shape=[None, seq_length, 1], dtype=tf.float32),
+        tf.TensorSpec(shape=[], dtype=tf.int32)
+    ])
+    def rollout(windows, steps):
+        predictions = tf.TensorArray(tf.float32, size=steps)
+        for i in tf.range(steps):
+            next_values = tf.reshape(model(windows, training=False), [-1, 1, 1])
+            predictions = predictions.write(i, next_values[:, 0, 0])
+            # 窗口左移一步，把预测值作为最新一个点
+            windows = tf.concat([windows[:, 1:, :], next_values], axis=1)
+        return tf.transpose(predictions.stack())
+
+    # 直接写入__dict__，不经过Keras的属性追踪
+    model.__dict__[_ROLLOUT_ATTR] = (seq_length, rollout)
+    return rollout
+
+
+def rollout_forecast(model, windows, steps=24):
+    """在一次编译好的图调用中完成多步滚动预测
+
+    windows: 已缩放的最近seq_length个点，形状为(seq_length,)或(batch, seq_length)
+    返回已缩放的预测值，形状为(steps,)或(batch, steps)
+    """
+    windows = np.asarray(windows, dtype=np.float32)
+    single = windows.ndim == 1
+    windows = windows.reshape(1 if single else windows.shape[0], -1, 1)
+    rollout = _compiled_rollout(model, windows.shape[1])
+    predictions = rollout(tf.constant(windows), tf.constant(steps, dtype=tf.int32)).numpy()
+    return predictions[0] if single else predictions
@@ -1,15 +1,86 @@
 import pandas as pd
 import numpy as np
+import atexit
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from statsmodels.tsa.arima.model import ARIMA
 from statsmodels.tsa.stattools import adfuller
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
+# 已拟合模型的结果缓存（LRU）：(序列哈希, 阶数) -> (AIC, 对数似然, 是否收敛)，拟合失败时为None
+FIT_CACHE_SIZE = 4096
+_fit_cache = OrderedDict()
+_fit_cache_lock = threading.Lock()
+
+# 参数搜索共用的进程池，避免每次搜索都重新启动工作进程
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _series_hash(data) -> str:
+    return hashlib.sha1(np.ascontiguousarray(data, dtype=np.float64).tobytes()).hexdigest()
+
+
+def _cache_get(key):
+    """返回(是否命中, 结果)，命中时移到最近使用的位置"""
+    with _fit_cache_lock:
+        if key not in _fit_cache:
+            return False, None
+        _fit_cache.move_to_end(key)
+        return True, _fit_cache[key]
+
+
+def _cache_put(key, result):
+    with _fit_cache_lock:
+        _fit_cache[key] = result
+        _fit_cache.move_to_end(key)
+        while len(_fit_cache) > FIT_CACHE_SIZE:
+            _fit_cache.popitem(last=False)
+
+
+def _get_executor(n_jobs: int) -> ProcessPoolExecutor:
+    """返回共用的进程池，需要更多进程或进程池已损坏时重新创建"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers < n_jobs or getattr(_executor, '_broken', False):
+            if _executor is not None:
+                # 不等待，其他线程已提交的任务会继续完成
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=n_jobs)
+            _executor_workers = n_jobs
+        return _executor
+
+
+@atexit.register
+def _shutdown_executor():
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fit_order(values: np.ndarray, order: Tuple[int, int, int]) -> Optional[Tuple[float, float, bool]]:
+    """拟合一个候选阶数，返回(AIC, 对数似然, 是否收敛)，失败时返回None"""
+    warnings.filterwarnings('ignore')
+    try:
+        results = ARIMA(values, order=order).fit()
+        converged = bool((getattr(results, 'mle_retvals', None) or {}).get('converged', True))
+        return float(results.aic), float(results.llf), converged
+    except Exception:
+        return None
+
+
 class WeatherARIMA:
-    def __init__(self):
+    def __init__(self, n_jobs: Optional[int] = None):
         self.model = None
         self.model_fit = None
+        self.n_jobs = n_jobs or os.cpu_count() or 1  # 参数搜索使用的进程数
+        self.search_results = {}
         
     def check_stationarity(self, data: pd.Series) -> Dict:
         """检查时间序列的平稳性"""
@@ -20,23 +91,78 @@ class WeatherARIMA:
             'Critical Values': result[4]
         }
     
+    def select_d(self, data: pd.Series, max_d: int = 2, alpha: float = 0.05) -> int:
+        """用ADF检验确定差分阶数：差分到平稳为止"""
+        series = pd.Series(np.asarray(data, dtype=float))
+        d = 0
+        while d < max_d and self.check_stationarity(series)['p-value'] > alpha:
+            series = series.diff().dropna()
+            d += 1
+        return d
+
     def find_best_parameters(self, data: pd.Series, max_p=3, max_d=2, max_q=3) -> Tuple[int, int, int]:
-        """寻找最佳ARIMA参数"""
+        """寻找最佳ARIMA参数
+
+        差分阶数d由ADF检验一次确定；p、q按参数个数从少到多并行搜索。
+        先拟合最大的(max_p, d, max_q)模型，其对数似然是所有嵌套候选的上界，
+        由此得到每个候选AIC的下界，不可能优于当前最优AIC的候选直接跳过。
+        只有收敛的拟合才用于剪枝：未收敛的最大模型给不出可靠的上界，此时搜索全部候选。
+        """
+        values = np.asarray(data, dtype=float)
+        series_hash = _series_hash(values)
+        d = self.select_d(values, max_d)
+        self.search_results = {}
+        executor = _get_executor(self.n_jobs) if self.n_jobs > 1 else None
+        fits = {}
+
+        def fit_all(orders):
+            pending = []
+            for order in orders:
+                hit, result = _cache_get((series_hash, order))
+                if hit:
+                    fits[order] = result
+                else:
+                    pending.append(order)
+            if executor is not None and len(pending) > 1:
+                fitted = executor.map(_fit_order, [values] * len(pending), pending)
+            else:
+                fitted = (_fit_order(values, order) for order in pending)
+            for order, result in zip(pending, fitted):
+                _cache_put((series_hash, order), result)
+                fits[order] = result
+            for order in orders:
+                if fits[order] is not None:
+                    self.search_results[order] = fits[order][0]
+
+        # 收敛的最大模型的对数似然作为上界
+        full_order = (max_p, d, max_q)
+        fit_all([full_order])
+        full = fits[full_order]
+        max_llf = full[1] if full is not None and full[2] else None
+        # 与p、q无关的参数个数：常数项（d=0时）和方差
+        base_params = (1 if d == 0 else 0) + 1
+
         best_aic = float('inf')
         best_params = None
-        
-        for p in range(max_p + 1):
-            for d in range(max_d + 1):
-                for q in range(max_q + 1):
-                    try:
-                        model = ARIMA(data, order=(p, d, q))
-                        results = model.fit()
-                        if results.aic < best_aic:
-                            best_aic = results.aic
-                            best_params = (p, d, q)
-                    except:
-                        continue
-        
+        best_converged = False
+        for k in range(max_p + max_q + 1):
+            # 只用收敛拟合的AIC剪枝
+            if best_converged and max_llf is not None and -2 * max_llf + 2 * (k + base_params) >= best_aic:
+                break
+            orders = [(p, d, k - p) for p in range(max_p + 1) if 0 <= k - p <= max_q]
+            fit_all(orders)
+            for order in orders:
+                result = fits[order]
+                if result is None:
+                    continue
+                aic, llf, converged = result
+                if converged and max_llf is not None and llf > max_llf:
+                    # 嵌套模型的似然更高，说明最大模型停在了局部最优，上界不成立
+                    max_llf = None
+                # 收敛的拟合优先，全部未收敛时才退而选择AIC最小的未收敛拟合
+                if (converged, -aic) > (best_converged, -best_aic):
+                    best_aic, best_params, best_converged = aic, order, converged
+
         return best_params
     
     def train(self, data: pd.Series, order: Tuple[int, int, int] = None):
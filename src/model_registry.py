@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+
+DEFAULT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
+
+
+class ModelRegistry:
+    """磁盘模型仓库：按主题和训练数据指纹保存/加载LSTM模型及其缩放器
+
+    目录结构：<root>/<topic>/<fingerprint>/{model.weights.h5, meta.json}，
+    <root>/<topic>/latest.json 指向该主题最新的模型（用于增量训练）
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, cache_size: int = 8):
+        self.root = root
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.topic_locks = {}
+
+    @staticmethod
+    def fingerprint(values, **params) -> str:
+        """根据训练数据和超参数计算指纹"""
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return h.hexdigest()[:20]
+
+    def _topic_dir(self, topic: str) -> str:
+        safe_topic = re.sub(r'[^A-Za-z0-9_.-]+', '_', topic).strip('_') or 'default'
+        return os.path.join(self.root, safe_topic)
+
+    def _path(self, topic: str, fingerprint: str) -> str:
+        return os.path.join(self._topic_dir(topic), fingerprint)
+
+    def save(self, topic: str, fingerprint: str, model, scaler: MinMaxScaler,
+             seq_length: int, hyperparams: Optional[Dict] = None, latest: bool = False, **extra) -> str:
+        """保存模型权重、缩放器参数、序列长度和超参数
+
+        latest为True时同时把该模型设为主题的最新模型
+        """
+        path = self._path(topic, fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写入临时目录再重命名，避免并发读取到不完整的文件
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            model.save_weights(os.path.join(tmp_dir, 'model.weights.h5'))
+            meta = {
+                'topic': topic,
+                'fingerprint': fingerprint,
+                'seq_length': seq_length,
+                'hyperparams': hyperparams or {},
+                'scaler': {
+                    'data_min': scaler.data_min_.tolist(),
+                    'data_max': scaler.data_max_.tolist(),
+                    'feature_range': list(scaler.feature_range)
+                },
+                'created_at': time.time()
+            }
+            meta.update(extra)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_dir, path)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        with self.lock:
+            self._remember((topic, fingerprint), {'model': model, 'scaler': scaler, 'meta': meta})
+        if latest:
+            self.set_latest(topic, fingerprint)
+        return path
+
+    def topic_lock(self, topic: str) -> threading.RLock:
+        """主题的可重入锁：分配版本号、保存模型和更新latest.json需要在同一把锁内完成"""
+        with self.lock:
+            lock = self.topic_locks.get(topic)
+            if lock is None:
+                lock = self.topic_locks[topic] = threading.RLock()
+            return lock
+
+    def next_version(self, topic: str) -> int:
+        """主题下所有模型的最大版本号加1（latest.json可能被缓存命中改回旧版本，不能只看最新模型）"""
+        topic_dir = self._topic_dir(topic)
+        version = 0
+        names = os.listdir(topic_dir) if os.path.isdir(topic_dir) else []
+        for name in names:
+            meta_path = os.path.join(topic_dir, name, 'meta.json')
+            if not os.path.exists(meta_path):
+                continue
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    version = max(version, int(json.load(f).get('version', 0)))
+            except (OSError, ValueError, TypeError):
+                continue
+        return version + 1
+
+    def set_latest(self, topic: str, fingerprint: str):
+        topic_dir = self._topic_dir(topic)
+        fd, tmp_path = tempfile.mkstemp(dir=topic_dir, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': fingerprint}, f)
+        os.replace(tmp_path, os.path.join(topic_dir, 'latest.json'))
+
+    def latest_fingerprint(self, topic: str) -> Optional[str]:
+        pointer = os.path.join(self._topic_dir(topic), 'latest.json')
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, 'r', encoding='utf-8') as f:
+            return json.load(f)['fingerprint']
+
+    def latest_meta(self, topic: str) -> Optional[Dict]:
+        """读取主题最新模型的元数据（不加载模型）"""
+        fingerprint = self.latest_fingerprint(topic)
+        meta_path = os.path.join(self._path(topic, fingerprint), 'meta.json') if fingerprint else None
+        if meta_path is None or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def latest(self, topic: str, build_model: Callable[[int], object]) -> Optional[Dict]:
+        """加载主题最新的模型，不存在时返回None"""
+        fingerprint = self.latest_fingerprint(topic)
+        return self.load(topic, fingerprint, build_model) if fingerprint else None
+
+    def load(self, topic: str, fingerprint: str, build_model: Callable[[int], object]) -> Optional[Dict]:
+        """加载匹配的模型，不存在时返回None
+
+        build_model: 根据seq_length构建同结构模型的函数，用于加载权重
+        """
+        key = (topic, fingerprint)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                return entry
+
+        path = self._path(topic, fingerprint)
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        model = build_model(meta['seq_length'])
+        model.load_weights(os.path.join(path, 'model.weights.h5'))
+        entry = {'model': model, 'scaler': self.restore_scaler(meta['scaler']), 'meta': meta}
+        with self.lock:
+            self._remember(key, entry)
+        return entry
+
+    @staticmethod
+    def restore_scaler(params: Dict) -> MinMaxScaler:
+        """用保存的最小值/最大值重建MinMaxScaler"""
+        scaler = MinMaxScaler(feature_range=tuple(params['feature_range']))
+        scaler.fit(np.array([params['data_min'], params['data_max']], dtype=np.float64))
+        return scaler
+
+    def _remember(self, key, entry):
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Tuple
+import numpy as np
+import pandas as pd
+from src.data_processor import load_series_arrays
+
+DEFAULT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.cache', 'series'))
+
+
+class SeriesCache:
+    """解析结果的二进制列式缓存
+
+    每个数据文件对应 <root>/<路径哈希>/ 目录，以.npy格式保存解析后的原始序列和重采样序列（默认按小时），
+    读取时通过mmap映射，不再解析文本。源文件的mtime或大小变化时缓存自动失效并重建。
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, freq: str = 'H'):
+        self.root = root
+        self.freq = freq
+
+    def _entry_dir(self, file_path: str) -> str:
+        path_hash = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.root, path_hash)
+
+    def _ensure(self, file_path: str) -> str:
+        """返回有效的缓存目录，缺失或过期时重新解析源文件"""
+        stat = os.stat(file_path)
+        signature = {'source': os.path.abspath(file_path), 'mtime_ns': stat.st_mtime_ns,
+                     'size': stat.st_size, 'freq': self.freq}
+        entry_dir = self._entry_dir(file_path)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if all(meta.get(key) == value for key, value in signature.items()):
+                return entry_dir
+
+        timestamps, values = load_series_arrays(file_path)
+        resampled = self._resample(timestamps, values)
+
+        # 写入临时目录后整体替换，避免读到不完整的缓存
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=self.root)
+        try:
+            np.save(os.path.join(tmp_dir, 'raw_timestamps.npy'), timestamps.astype('datetime64[s]').view(np.int64))
+            np.save(os.path.join(tmp_dir, 'raw_values.npy'), values)
+            np.save(os.path.join(tmp_dir, 'resampled_values.npy'), resampled.to_numpy(dtype=np.float64))
+            meta = dict(signature, resampled_start=str(resampled.index[0]) if len(resampled) else None)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return entry_dir
+
+    def _resample(self, timestamps: np.ndarray, values: np.ndarray) -> pd.Series:
+        """重采样到固定频率，同一区间取平均值并按时间插值"""
+        series = pd.Series(values, index=pd.DatetimeIndex(timestamps))
+        return series.resample(self.freq).mean().interpolate(method='time')
+
+    def load_raw(self, file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+        """读取解析后的原始序列(timestamps, values)，数组为只读mmap"""
+        entry_dir = self._ensure(file_path)
+        timestamps = np.load(os.path.join(entry_dir, 'raw_timestamps.npy'), mmap_mode='r')
+        values = np.load(os.path.join(entry_dir, 'raw_values.npy'), mmap_mode='r')
+        return timestamps.view('datetime64[s]'), values
+
+    def load_series(self, file_path: str) -> pd.Series:
+        """读取解析后的原始序列为pd.Series"""
+        timestamps, values = self.load_raw(file_path)
+        return pd.Series(values, index=pd.DatetimeIndex(timestamps), name='value')
+
+    def load_resampled(self, file_path: str) -> pd.Series:
+        """读取重采样后的序列，数值为只读mmap"""
+        entry_dir = self._ensure(file_path)
+        with open(os.path.join(entry_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        values = np.load(os.path.join(entry_dir, 'resampled_values.npy'), mmap_mode='r')
+        if not len(values):
+            return pd.Series(values, index=pd.DatetimeIndex([]), name='value')
+        index = pd.date_range(start=meta['resampled_start'], periods=len(values), freq=self.freq)
+        return pd.Series(values, index=index, name='value')
+
+
+series_cache = SeriesCache()
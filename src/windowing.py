@@ -0,0 +1,79 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from tensorflow.keras.utils import Sequence
+
+# 窗口视图实际展开后超过该大小时，改为按批从视图生成数据
+MAX_IN_MEMORY_BYTES = 256 * 1024 * 1024
+
+
+def sliding_windows(data, seq_length):
+    """构建LSTM输入：X[i] = data[i:i+seq_length]，y[i] = data[i+seq_length]
+
+    X是原序列上的只读滑动窗口视图，形状为(samples, seq_length, 1)，
+    不会复制重叠的窗口数据；y的形状为(samples, 1)。
+    """
+    series = np.ascontiguousarray(data, dtype=np.float32).reshape(-1)
+    if len(series) <= seq_length:
+        raise ValueError(f"数据长度({len(series)})必须大于序列长度({seq_length})")
+    X = sliding_window_view(series[:-1], seq_length)[:, :, np.newaxis]
+    y = series[seq_length:].reshape(-1, 1)
+    return X, y
+
+
+class WindowSequence(Sequence):
+    """按批从窗口视图取数据，每次只复制当前批次的窗口"""
+
+    def __init__(self, X, y=None, batch_size=32, shuffle=False):
+        super().__init__()
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.indices = np.arange(len(X))
+        if shuffle:
+            np.random.shuffle(self.indices)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, index):
+        batch = self.indices[index * self.batch_size:(index + 1) * self.batch_size]
+        if self.y is None:
+            return self.X[batch]
+        return self.X[batch], self.y[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+
+def fit_windows(model, X, y, epochs=20, batch_size=32, validation_split=0.1, callbacks=None, verbose=1,
+                max_in_memory_bytes=MAX_IN_MEMORY_BYTES):
+    """训练模型；窗口数据过大时按批从视图喂给模型，避免一次性展开"""
+    if X.nbytes <= max_in_memory_bytes:
+        return model.fit(
+            X, y,
+            epochs=epochs,
+            batch_size=batch_size,
+            validation_split=validation_split,
+            callbacks=callbacks,
+            verbose=verbose
+        )
+
+    # 与validation_split一致：取最后一部分样本作为验证集
+    split = int(len(X) * (1 - validation_split))
+    validation_data = WindowSequence(X[split:], y[split:], batch_size) if split < len(X) else None
+    return model.fit(
+        WindowSequence(X[:split], y[:split], batch_size, shuffle=True),
+        validation_data=validation_data,
+        epochs=epochs,
+        callbacks=callbacks,
+        verbose=verbose
+    )
+
+
+def predict_windows(model, X, batch_size=256, verbose=0, max_in_memory_bytes=MAX_IN_MEMORY_BYTES):
+    """对窗口数据做预测，数据过大时按批处理"""
+    if X.nbytes <= max_in_memory_bytes:
+        return model.predict(X, batch_size=batch_size, verbose=verbose)
+    return model.predict(WindowSequence(X, batch_size=batch_size), verbose=verbose)
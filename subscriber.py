@@ -1,5 +1,7 @@
 import paho.mqtt.client as mqtt
+import argparse
 import json
+import queue
 import tkinter as tk
 from tkinter import ttk
 import matplotlib.pyplot as plt
@@ -7,17 +9,25 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import threading
 from tkinter import messagebox
 from collections import deque
+import numpy as np
 import time
 
 class SubscriberGUI:
-    def __init__(self):
+    def __init__(self, window_length=50, fps=10, blit=True):
         self.root = tk.Tk()
         self.root.title("MQTT数据订阅器")
         self.root.geometry("1000x800")
         
         self.subscriber = SimpleSubscriber(self.update_data)
-        self.data_queue = deque(maxlen=50)  # 存储最近50条数据
+        self.window_length = window_length
+        self.frame_interval = max(1, int(1000 / fps))
+        self.blit = blit
+        self.data_queue = deque(maxlen=window_length)  # 存储最近window_length条数据
+        # MQTT线程只往这里放数据，由Tk主循环定时取出并绘制
+        self.incoming = queue.Queue()
+        self.background = None
         self.setup_gui()
+        self.root.after(self.frame_interval, self.render_frame)
         
     def setup_gui(self):
         # 连接设置框架
@@ -41,9 +51,21 @@ class SubscriberGUI:
         display_frame = ttk.LabelFrame(self.root, text="数据显示", padding="5")
         display_frame.pack(fill="both", expand=True, padx=5, pady=5)
         
-        # 创建图表
+        # 创建图表，横轴为窗口内的位置，只有纵轴范围不够时才整体重绘
         self.fig, (self.ax1, self.ax2) = plt.subplots(2, 1, figsize=(10, 6))
+        self.temp_line, = self.ax1.plot([], [], 'r-', label='温度', animated=self.blit)
+        self.ax1.set_ylabel('温度 (°C)')
+        self.humid_line, = self.ax2.plot([], [], 'b-', label='湿度', animated=self.blit)
+        self.ax2.set_ylabel('湿度 (%)')
+        self.ax2.set_xlabel(f'最近{self.window_length}条数据')
+        for ax in (self.ax1, self.ax2):
+            ax.set_xlim(0, max(1, self.window_length - 1))
+            ax.set_ylim(0, 1)
+            ax.legend(loc='upper left')
+        self.fig.tight_layout()
         self.canvas = FigureCanvasTkAgg(self.fig, master=display_frame)
+        # 每次完整重绘（包括窗口缩放）后重新缓存背景
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(fill="both", expand=True)
         
@@ -63,31 +85,64 @@ class SubscriberGUI:
             messagebox.showerror("错误", f"连接失败: {str(e)}")
     
     def update_data(self, data):
-        self.data_queue.append(data)
-        self.data_text.insert("end", f"收到数据: {data}\n")
-        self.data_text.see("end")
-        self.update_plots()
+        # 在MQTT网络线程中调用，不能直接操作Tk控件
+        self.incoming.put_nowait(data)
+
+    def render_frame(self):
+        """Tk主循环中按固定帧率取出新数据并更新界面"""
+        received = []
+        while True:
+            try:
+                received.append(self.incoming.get_nowait())
+            except queue.Empty:
+                break
+        if received:
+            self.data_queue.extend(received)
+            # 文本框只显示最近window_length条
+            self.data_text.insert("end", "".join(f"收到数据: {data}\n" for data in received[-self.window_length:]))
+            lines = int(self.data_text.index("end-1c").split(".")[0])
+            if lines > self.window_length:
+                self.data_text.delete("1.0", f"{lines - self.window_length}.0")
+            self.data_text.see("end")
+            self.update_plots()
+        self.root.after(self.frame_interval, self.render_frame)
     
     def update_plots(self):
-        self.ax1.clear()
-        self.ax2.clear()
-        
-        times = [d['time'] for d in self.data_queue]
-        temps = [d['temperature'] for d in self.data_queue]
-        humids = [d['humidity'] for d in self.data_queue]
-        
-        self.ax1.plot(times, temps, 'r-', label='温度')
-        self.ax1.set_ylabel('温度 (°C)')
-        self.ax1.legend()
-        self.ax1.tick_params(axis='x', rotation=45)
-        
-        self.ax2.plot(times, humids, 'b-', label='湿度')
-        self.ax2.set_ylabel('湿度 (%)')
-        self.ax2.legend()
-        self.ax2.tick_params(axis='x', rotation=45)
-        
-        plt.tight_layout()
-        self.canvas.draw()
+        temps = np.array([d.get('temperature', np.nan) for d in self.data_queue], dtype=float)
+        humids = np.array([d.get('humidity', np.nan) for d in self.data_queue], dtype=float)
+        positions = np.arange(len(self.data_queue))
+        self.temp_line.set_data(positions, temps)
+        self.humid_line.set_data(positions, humids)
+
+        rescaled = self.fit_ylim(self.ax1, temps) | self.fit_ylim(self.ax2, humids)
+        if not self.blit or rescaled or self.background is None:
+            # 坐标轴变化时完整重绘，draw_event中会重新缓存背景并画出曲线
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.ax1.draw_artist(self.temp_line)
+        self.ax2.draw_artist(self.humid_line)
+        self.canvas.blit(self.fig.bbox)
+
+    @staticmethod
+    def fit_ylim(ax, values):
+        """数据超出纵轴范围时扩大范围并留出余量，返回是否修改了范围"""
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return False
+        low, high = ax.get_ylim()
+        vmin, vmax = values.min(), values.max()
+        if low <= vmin and vmax <= high:
+            return False
+        margin = max((vmax - vmin) * 0.2, 1.0)
+        ax.set_ylim(vmin - margin, vmax + margin)
+        return True
+
+    def on_draw(self, event):
+        if self.blit:
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self.ax1.draw_artist(self.temp_line)
+            self.ax2.draw_artist(self.humid_line)
     
     def run(self):
         self.root.mainloop()
@@ -121,5 +176,11 @@ class SimpleSubscriber:
             print(f"Connection error: {e}")
 
 if __name__ == '__main__':
-    gui = SubscriberGUI()
+    parser = argparse.ArgumentParser(description='MQTT数据订阅器')
+    parser.add_argument('--window-length', type=int, default=50, help='图表显示的数据条数')
+    parser.add_argument('--fps', type=float, default=10, help='最大刷新帧率')
+    parser.add_argument('--no-blit', action='store_true', help='关闭blit，每帧完整重绘')
+    args = parser.parse_args()
+
+    gui = SubscriberGUI(window_length=args.window_length, fps=args.fps, blit=not args.no_blit)
     gui.run()
\ No newline at end of file
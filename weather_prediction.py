@@ -5,6 +5,9 @@
 # 所得处理后数据的解释(存储在result文件夹中)：
 # xxx_test_results.csv：包含xxx测试集(data后20%)的实际值和预测值
 # xxx_future_predictions.csv：包含data/xxx.txt未来24小时的预测值
+# all_test_results.csv / all_future_predictions.csv：按时间戳合并的汇总结果
+
+# 用法：python weather_prediction.py [--parallel] [--workers N] [--threads-per-worker N]
 
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
@@ -12,43 +15,27 @@ from tensorflow.keras.layers import LSTM, Dense, Dropout
 from sklearn.preprocessing import MinMaxScaler
 import numpy as np
 import pandas as pd
-import json
-from datetime import datetime
 import matplotlib.pyplot as plt
 import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.series_cache import series_cache
+from src.model_registry import model_registry
+from src.windowing import sliding_windows, fit_windows, predict_windows
+from src.forecasting import rollout_forecast
 
 class WeatherPredictor:
-    def __init__(self):
+    def __init__(self, registry=model_registry):
         self.models = {}
         self.scalers = {}  # 用于存储数据缩放器
+        self.registry = registry  # 模型仓库，为None时每次都重新训练
         
     def load_data(self, file_path):
         """加载数据并转换为时间序列格式"""
-        data = []
-        with open(file_path, 'r') as f:
-            for line in f:
-                if line.strip():
-                    # 解析每行的JSON数据
-                    record = json.loads(line.strip())
-                    for timestamp, value in record.items():
-                        if value.strip():  # 排除空值
-                            data.append({
-                                'timestamp': datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S'),
-                                'value': float(value)
-                            })
-        
-        # 转换为DataFrame并按时间排序
-        df = pd.DataFrame(data)
-        df.set_index('timestamp', inplace=True)
-        df.sort_index(inplace=True)
-        
-        # 重采样到小时级别，使用平均值处理同一小时内的多个数据点
-        df = df.resample('H').mean()
-        
-        # 处理缺失值
-        df = df.interpolate(method='time')
-        
-        return df
+        # 重采样到小时级别（同一小时内取平均值，缺失值按时间插值），
+        # 结果缓存为二进制文件，再次运行时直接mmap读取
+        return series_cache.load_resampled(file_path).to_frame('value')
         
     def evaluate_model(self, y_true, y_pred):
         """评估模型性能"""
@@ -64,17 +51,8 @@ class WeatherPredictor:
         }
     
     def create_sequences(self, data, seq_length):
-        """创建用于LSTM的序列数据"""
-        sequences = []
-        targets = []
-        
-        for i in range(len(data) - seq_length):
-            seq = data[i:(i + seq_length)]
-            target = data[i + seq_length]
-            sequences.append(seq)
-            targets.append(target)
-            
-        return np.array(sequences), np.array(targets)
+        """创建用于LSTM的序列数据（滑动窗口视图，不复制重叠数据）"""
+        return sliding_windows(data, seq_length)
     
     def build_lstm_model(self, seq_length):
         """构建LSTM模型"""
@@ -89,14 +67,27 @@ class WeatherPredictor:
         model.compile(optimizer='adam', loss='mse', metrics=['mae'])
         return model
     
-    def train_lstm(self, data, seq_length=24, epochs=50, batch_size=32):
-        """训练LSTM模型"""
+    def train_lstm(self, data, seq_length=24, epochs=50, batch_size=32, topic=None):
+        """训练LSTM模型，指定topic时优先复用模型仓库中相同数据训练过的模型"""
         # 保存时间索引用于绘图
         self.time_index = data.index  # 添加这行来保存原始数据的时间索引
         
+        # 查找已训练的模型
+        entry = None
+        fingerprint = None
+        history = None
+        if topic is not None and self.registry is not None:
+            hyperparams = {'seq_length': seq_length, 'epochs': epochs, 'batch_size': batch_size}
+            fingerprint = self.registry.fingerprint(data.values, model='batch_lstm', **hyperparams)
+            entry = self.registry.load(topic, fingerprint, self.build_lstm_model)
+        
         # 数据缩放
-        scaler = MinMaxScaler()
-        scaled_data = scaler.fit_transform(data.values.reshape(-1, 1))
+        if entry is not None:
+            scaler = entry['scaler']
+            scaled_data = scaler.transform(data.values.reshape(-1, 1))
+        else:
+            scaler = MinMaxScaler()
+            scaled_data = scaler.fit_transform(data.values.reshape(-1, 1))
         self.scalers['lstm'] = scaler
         
         # 创建序列数据
@@ -107,22 +98,28 @@ class WeatherPredictor:
         X_train, X_test = X[:train_size], X[train_size:]
         y_train, y_test = y[:train_size], y[train_size:]
         
-        # 构建和训练模型
-        model = self.build_lstm_model(seq_length)
-        history = model.fit(
-            X_train, y_train,
-            epochs=epochs,
-            batch_size=batch_size,
-            validation_split=0.1,
-            verbose=1
-        )
+        if entry is not None:
+            print(f"复用已保存的模型: {topic} ({fingerprint})")
+            model = entry['model']
+        else:
+            # 构建和训练模型
+            model = self.build_lstm_model(seq_length)
+            history = fit_windows(
+                model, X_train, y_train,
+                epochs=epochs,
+                batch_size=batch_size,
+                validation_split=0.1,
+                verbose=1
+            )
+            if fingerprint is not None:
+                self.registry.save(topic, fingerprint, model, scaler, seq_length, hyperparams)
         
         # 保存模型
         self.models['lstm'] = model
         
         # 进行预测
-        train_pred = model.predict(X_train)
-        test_pred = model.predict(X_test)
+        train_pred = predict_windows(model, X_train)
+        test_pred = predict_windows(model, X_test)
         
         # 反向转换数据
         train_pred = scaler.inverse_transform(train_pred)
@@ -149,22 +146,11 @@ class WeatherPredictor:
         if model is None or scaler is None:
             raise ValueError("请先训练LSTM模型")
         
-        current_sequence = last_sequence.copy()
-        predictions = []
-        
-        for _ in range(steps):
-            # 缩放数据
-            scaled_sequence = scaler.transform(current_sequence.reshape(-1, 1))
-            # 预测下一个值
-            next_pred = model.predict(scaled_sequence.reshape(1, -1, 1))
-            # 反向转换预测值
-            next_pred_orig = scaler.inverse_transform(next_pred)[0][0]
-            predictions.append(next_pred_orig)
-            # 更新序列
-            current_sequence = np.roll(current_sequence, -1)
-            current_sequence[-1] = next_pred_orig
+        # 只缩放一次，在已缩放的窗口上滚动预测
+        scaled_sequence = scaler.transform(np.asarray(last_sequence, dtype=float).reshape(-1, 1))
+        predictions = rollout_forecast(model, scaled_sequence.ravel(), steps)
             
-        return np.array(predictions)
+        return scaler.inverse_transform(predictions.reshape(-1, 1)).ravel()
     
     def plot_lstm_results(self, results, title):
         """绘制LSTM模型的训练结果"""
@@ -216,7 +202,110 @@ class WeatherPredictor:
         plt.tight_layout()
         plt.show()
 
-def main():
+# 已知数据类型的单位和标题，其他文件使用通用设置
+KNOWN_DATA_TYPES = {
+    'temperature': {'unit': '°C', 'title': 'Temperature'},
+    'humidity': {'unit': '%', 'title': 'Humidity'},
+    'pressure': {'unit': 'hPa', 'title': 'Pressure'}
+}
+
+# 数据文件夹中不是观测数据的文件（页面回放用的测试样例），不参与训练和合并
+EXCLUDED_DATA_FILES = {'test.txt'}
+
+
+def discover_data_types(input_folder):
+    """查找数据文件夹中的所有txt数据文件（跳过EXCLUDED_DATA_FILES）"""
+    data_types = {}
+    for filename in sorted(os.listdir(input_folder)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.txt' or filename in EXCLUDED_DATA_FILES:
+            continue
+        info = KNOWN_DATA_TYPES.get(name, {'unit': 'value', 'title': name.capitalize()})
+        data_types[name] = dict(info, file=os.path.join(input_folder, filename))
+    return data_types
+
+
+def init_worker(threads):
+    """进程池初始化：每个进程使用独立的TF运行时，并限制线程数避免CPU超额订阅"""
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def process_data_type(data_type, info, output_folder, seq_length=24, epochs=50, batch_size=32):
+    """处理一种数据：训练、评估、预测未来24小时并导出CSV"""
+    predictor = WeatherPredictor()
+    print(f"\nProcessing {data_type.capitalize()} data...")
+
+    # 加载数据
+    data = predictor.load_data(info['file'])
+
+    # 训练LSTM模型
+    print(f"\nTraining LSTM model for {data_type}...")
+    lstm_results = predictor.train_lstm(
+        data['value'],
+        seq_length=seq_length,
+        epochs=epochs,
+        batch_size=batch_size,
+        topic=data_type
+    )
+
+    # 评估LSTM模型
+    lstm_metrics = predictor.evaluate_model(
+        lstm_results['y_test'],
+        lstm_results['test_pred']
+    )
+    print(f"\n{data_type.capitalize()} LSTM Model Evaluation Results:")
+    for metric, value in lstm_metrics.items():
+        print(f"{metric}: {value:.4f}")
+
+    # 绘制LSTM预测结果
+    # predictor.plot_lstm_results(lstm_results, f"LSTM {info['title']} Prediction Results")
+
+    # 预测未来24小时
+    last_sequence = data['value'].values[-seq_length:]
+    future_predictions = predictor.predict_future_lstm(last_sequence)
+
+    # 导出测试集结果
+    unit = info['unit']
+    test_time_index = predictor.time_index[-len(lstm_results['test_pred']):]
+    test_data = pd.DataFrame({
+        'timestamp': test_time_index,
+        f'actual_{data_type}_{unit}': lstm_results['y_test'].flatten(),
+        f'predicted_{data_type}_{unit}': lstm_results['test_pred'].flatten()
+    })
+    test_data.to_csv(os.path.join(output_folder, f'{data_type}_test_results.csv'), index=False)
+
+    # 导出未来预测结果
+    last_timestamp = predictor.time_index[-1]
+    future_timestamps = pd.date_range(
+        start=last_timestamp + pd.Timedelta(hours=1),
+        periods=len(future_predictions),
+        freq='H'
+    )
+    future_data = pd.DataFrame({
+        'timestamp': future_timestamps,
+        f'predicted_{data_type}_{unit}': future_predictions
+    })
+    future_data.to_csv(os.path.join(output_folder, f'{data_type}_future_predictions.csv'), index=False)
+
+    return {key: float(value) for key, value in lstm_metrics.items()}
+
+
+def merge_exports(output_folder, data_types):
+    """把各数据类型的CSV按时间戳合并为汇总文件"""
+    for suffix in ('test_results', 'future_predictions'):
+        frames = []
+        for data_type in data_types:
+            path = os.path.join(output_folder, f'{data_type}_{suffix}.csv')
+            if os.path.exists(path):
+                frames.append(pd.read_csv(path, index_col='timestamp'))
+        if frames:
+            merged = pd.concat(frames, axis=1, join='outer').sort_index()
+            merged.to_csv(os.path.join(output_folder, f'all_{suffix}.csv'))
+
+
+def main(parallel=False, workers=None, threads_per_worker=None, epochs=50):
     # 定义输入输出路径
     input_folder = "data"  # 原始数据文件夹
     output_folder = "results"  # 输出结果文件夹
@@ -225,98 +314,53 @@ def main():
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    predictor = WeatherPredictor()
+    # 要处理的数据类型：data文件夹中的所有数据文件
+    data_types = discover_data_types(input_folder)
 
-    # 定义要处理的数据类型
-    data_types = {
-        'temperature': {
-            'file': os.path.join(input_folder, 'temperature.txt'),
-            'unit': '°C',
-            'title': 'Temperature'
-        },
-        'humidity': {
-            'file': os.path.join(input_folder, 'humidity.txt'),
-            'unit': '%',
-            'title': 'Humidity'
-        },
-        'pressure': {
-            'file': os.path.join(input_folder, 'pressure.txt'),
-            'unit': 'hPa',
-            'title': 'Pressure'
-        }
-    }
-    
-    # 存储所有结果
-    all_results = {}
-    
-    # 对每种数据类型进行处理
-    for data_type, info in data_types.items():
-        print(f"\nProcessing {data_type.capitalize()} data...")
-        
-        # 加载数据
-        data = predictor.load_data(info['file'])
-        
-        # 训练LSTM模型
-        print(f"\nTraining LSTM model for {data_type}...")
-        lstm_results = predictor.train_lstm(
-            data['value'],
-            seq_length=24,
-            epochs=50,
-            batch_size=32
-        )
-        
-        # 评估LSTM模型
-        lstm_metrics = predictor.evaluate_model(
-            lstm_results['y_test'],
-            lstm_results['test_pred']
-        )
-        print(f"\n{data_type.capitalize()} LSTM Model Evaluation Results:")
-        for metric, value in lstm_metrics.items():
-            print(f"{metric}: {value:.4f}")
-        
-        # 绘制LSTM预测结果
-        # predictor.plot_lstm_results(lstm_results, f"LSTM {info['title']} Prediction Results")
-        
-        # 预测未来24小时
-        last_sequence = data['value'].values[-24:]
-        future_predictions = predictor.predict_future_lstm(last_sequence)
-        
-        # 保存结果
-        all_results[data_type] = {
-            'lstm_results': lstm_results,
-            'future_predictions': future_predictions,
-            'time_index': predictor.time_index,
-            'unit': info['unit']
-        }
-    
-    # 导出所有数据
-    for data_type, results in all_results.items():
-        # 导出测试集结果
-        test_time_index = results['time_index'][-len(results['lstm_results']['test_pred']):]
-        test_data = pd.DataFrame({
-            'timestamp': test_time_index,
-            f'actual_{data_type}_{results["unit"]}': results['lstm_results']['y_test'].flatten(),
-            f'predicted_{data_type}_{results["unit"]}': results['lstm_results']['test_pred'].flatten()
-        })
-        test_data.to_csv(os.path.join(output_folder, f'{data_type}_test_results.csv'), index=False)
+    # 存储所有评估结果
+    all_metrics = {}
+
+    if parallel:
+        # 每个数据类型一个任务，进程池中每个进程有独立的TF会话
+        cpu_count = os.cpu_count() or 1
+        workers = workers or min(len(data_types), cpu_count)
+        threads_per_worker = threads_per_worker or max(1, cpu_count // workers)
+        print(f"Parallel mode: {workers} workers x {threads_per_worker} threads")
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=init_worker, initargs=(threads_per_worker,)) as executor:
+            futures = {
+                executor.submit(process_data_type, data_type, info, output_folder, epochs=epochs): data_type
+                for data_type, info in data_types.items()
+            }
+            for future in as_completed(futures):
+                data_type = futures[future]
+                try:
+                    all_metrics[data_type] = future.result()
+                except Exception as e:
+                    print(f"处理{data_type}数据时出错: {e}")
+    else:
+        for data_type, info in data_types.items():
+            try:
+                all_metrics[data_type] = process_data_type(data_type, info, output_folder, epochs=epochs)
+            except Exception as e:
+                print(f"处理{data_type}数据时出错: {e}")
 
-        # 导出未来预测结果
-        last_timestamp = results['time_index'][-1]
-        future_timestamps = pd.date_range(
-            start=last_timestamp + pd.Timedelta(hours=1),
-            periods=24,
-            freq='H'
-        )
-        future_data = pd.DataFrame({
-            'timestamp': future_timestamps,
-            f'predicted_{data_type}_{results["unit"]}': results['future_predictions']
-        })
-        future_data.to_csv(os.path.join(output_folder, f'{data_type}_future_predictions.csv'), index=False)
+    processed = [data_type for data_type in data_types if data_type in all_metrics]
+    merge_exports(output_folder, processed)
 
     print("\n数据已导出到CSV文件：")
-    for data_type in data_types.keys():
+    for data_type in processed:
         print(f"- {output_folder}/{data_type}_test_results.csv：包含{data_type}测试集的实际值和预测值")
         print(f"- {output_folder}/{data_type}_future_predictions.csv：包含{data_type}未来24小时的预测值")
+    print(f"- {output_folder}/all_test_results.csv、all_future_predictions.csv：按时间戳合并的汇总结果")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='训练LSTM模型并导出预测结果')
+    parser.add_argument('--parallel', action='store_true', help='使用进程池并行训练各数据类型')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为数据文件数与CPU核数的较小值')
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='每个进程的TF线程数')
+    parser.add_argument('--epochs', type=int, default=50, help='训练轮数')
+    args = parser.parse_args()
+    main(parallel=args.parallel, workers=args.workers,
+         threads_per_worker=args.threads_per_worker, epochs=args.epochs)